@@ -3,51 +3,62 @@ from datetime import datetime
 from typing import List, Dict, Tuple, Optional
 
 import matplotlib.pyplot as plt
-from commonroad.geometry.shape import Rectangle
 from commonroad.scenario.trajectory import State
+from matplotlib.artist import Artist
 
 from common import load_scenario, flatten_dict_values, VehicleInfo, MyState
+from common.compiled import CompiledScenario
 from common.draw import DrawHelp
+from common.export import FrameExporter
 from common.generation import GenerationHelp
 from common.prm import dijkstra_search
 
+# If set a frame per time step is streamed to this file instead of showing the plot. Paths ending with ".mp4" are encoded
+# using ffmpeg. Any other path is used as pattern for the paths of single images like "frame_{:03d}.png".
+output_path: Optional[str] = None
+
 
 def main() -> None:
     scenario, planning_problem = load_scenario('scenarios/DEU_B471-1_1_T-1_mod.xml')
+    compiled_scenario: CompiledScenario = CompiledScenario(scenario, planning_problem)
 
     plt.figure(figsize=(25, 10))
 
-    DrawHelp.draw(DrawHelp.convert_to_drawable(scenario))
+    DrawHelp.draw(DrawHelp.convert_to_drawable(compiled_scenario))
     DrawHelp.draw(DrawHelp.convert_to_drawable(planning_problem.initial_state))
 
     start_time: datetime = datetime.now()
     generation_result: Tuple[Dict[int, List[VehicleInfo]], int] \
-        = GenerationHelp.generate_states(scenario, MyState(planning_problem.initial_state), 15)
+        = GenerationHelp.generate_states(compiled_scenario, MyState(planning_problem.initial_state), 15)
     # NOTE The value 50 is taken from the commonroad file
     num_states_processed: int = generation_result[1]
     valid_converted: Dict[int, List[VehicleInfo]] = generation_result[0]
     valid_states: List[State] = list(map(lambda v: v.state.state, flatten_dict_values(valid_converted)))
     print("Processed " + str(num_states_processed) + " states in " + str(datetime.now() - start_time))
 
-    # FIXME Properly define goal states
-    goal_states: List[State] = []
-    for goal in planning_problem.goal.state_list:
-        if isinstance(goal.position, Rectangle):
-            goal.position = goal.position.center
-            goal.orientation = (goal.orientation.end + goal.orientation.start) / 2
-        goal.time_step = 16
-        goal_states.append(goal)
+    # All generated states within the goal region of the planning problem are goal states
     search_result: Optional[Tuple[List[State], float]] = dijkstra_search(
-        planning_problem.initial_state, goal_states, valid_states)
-
-    if search_result:
-        for state in search_result[0]:
-            DrawHelp.draw(DrawHelp.convert_to_drawable(state))
-    else:
-        print("Could not find path to goal")
+        planning_problem.initial_state, compiled_scenario, valid_states)
 
     plt.gca().set_aspect('equal')
-    plt.show()
+    if output_path is None:
+        if search_result:
+            DrawHelp.draw_vehicles([VehicleInfo(MyState(state), None) for state in search_result[0]])
+        else:
+            print("Could not find path to goal")
+        plt.show()
+    else:
+        # Stream a frame per time step showing all generated states and the state of the path of that time step
+        path_states: Dict[int, State] = {state.time_step: state for state in search_result[0]} if search_result else {}
+        with FrameExporter(plt.gcf(), output_path, 1 / scenario.dt) as exporter:
+            for time_step in sorted(valid_converted.keys()):
+                frame: List[Artist] = [DrawHelp.draw_vehicles(valid_converted[time_step])]
+                if time_step in path_states:
+                    frame.append(DrawHelp.draw_vehicles([VehicleInfo(MyState(path_states[time_step]), None)]))
+                frame = [artist for artist in frame if artist is not None]
+                exporter.write_frame(frame)
+                for artist in frame:
+                    artist.remove()
 
 
 if __name__ == '__main__':
@@ -1,23 +1,68 @@
 import datetime
 from datetime import datetime
-from typing import List, Optional
+from typing import List, Optional, Dict
 
 import matplotlib.pyplot as plt
-from matplotlib.animation import ArtistAnimation
+from matplotlib.animation import FuncAnimation
 from matplotlib.artist import Artist
-from shapely.geometry import MultiPolygon
+from matplotlib.figure import Figure
+from shapely.geometry import Polygon
+from shapely.geometry.base import BaseGeometry
+from shapely.ops import unary_union
 
-from common import load_scenario, flatten_dict_values, VehicleInfo, MyState
+from common import load_scenario, VehicleInfo, MyState
 from common.draw import DrawHelp
+from common.export import FrameExporter
 from common.generation import GenerationHelp
 
 num_steps: int = 10
+# If set the frames are streamed to this file instead of being shown. Paths ending with ".mp4" are encoded using ffmpeg.
+# Any other path is used as pattern for the paths of single images like "frame_{:03d}.png".
+output_path: Optional[str] = None
+
+
+class DrivableAreaAnimation:
+    """
+    Builds the frames of the drivable area incrementally. Each frame adds the vehicles of a single time step as a
+    collection and replaces the boundary of the drivable area by the one including the new time step.
+    """
+
+    def __init__(self, valid_converted: Dict[int, List[VehicleInfo]]):
+        self.valid_converted = valid_converted
+        self.layers: List[Artist] = []
+        self.union: Optional[BaseGeometry] = None
+        self.boundary: Optional[Artist] = None
+
+    def reset(self) -> List[Artist]:
+        for artist in self.layers + [self.boundary]:
+            if artist is not None:
+                artist.remove()
+        self.layers = []
+        self.union = None
+        self.boundary = None
+        return []
+
+    def update(self, step: int) -> List[Artist]:
+        """
+        Draws the vehicles of the given time step and the drivable area up to the given time step.
+        :return: The artists which changed.
+        """
+        vehicles: List[VehicleInfo] = self.valid_converted.get(step, [])
+        layer: Optional[Artist] = DrawHelp.draw_vehicles(vehicles)
+        if layer is not None:
+            self.layers.append(layer)
+        layer_union: BaseGeometry = unary_union([Polygon(v.footprint) for v in vehicles])
+        self.union = layer_union if self.union is None else self.union.union(layer_union)
+        if self.boundary is not None:
+            self.boundary.remove()
+        self.boundary = DrawHelp.draw_geometries([self.union])
+        return [artist for artist in [layer, self.boundary] if artist is not None]
 
 
 def main() -> None:
     scenario, planning_problem = load_scenario('scenarios/DEU_B471-1_1_T-1_mod.xml')
 
-    fig = plt.figure(figsize=(25, 10))
+    fig: Figure = plt.figure(figsize=(25, 10))
 
     DrawHelp.draw(DrawHelp.convert_to_drawable(scenario))
     DrawHelp.draw(DrawHelp.convert_to_drawable(planning_problem.initial_state))
@@ -30,29 +75,26 @@ def main() -> None:
         = GenerationHelp.generate_states(scenario, MyState(planning_problem.initial_state), num_steps)
     print("Processed " + str(num_states_processed) + " states in " + str(datetime.now() - start_time))
 
-    all_states: List[VehicleInfo] = flatten_dict_values(valid_converted)
-
-    frames: list = []
-
-    for i in range(1, num_steps + 1):
-        frame = list(map(lambda v: DrawHelp.draw(v.drawable), filter(lambda v: v.state.state.time_step <= i, all_states)))
-        union: MultiPolygon = DrawHelp.union_to_polygon(frame)
-        artist: Optional[Artist] = DrawHelp.draw(union)
-        if artist is not None:
-            if isinstance(artist, list):
-                frame.extend(artist)
-            else:
-                frame.append(artist)
-        frames.append(frame)
-
-    print("Drivable area: " + str(union.area))
-
     plt.gca().set_aspect('equal')
     plt.ylim([35, 60])
     plt.xlim([92, 150])
-    ani = ArtistAnimation(fig, frames, interval=500, blit=True, repeat_delay=1000)
-    # ani.save("2019-02-16_SimpleDrivableArea_10steps_35ms.mp4", writer="ffmpeg")  # mp4 broken
-    plt.show()
+
+    animation: DrivableAreaAnimation = DrivableAreaAnimation(valid_converted)
+    if output_path is None:
+        ani = FuncAnimation(fig, animation.update, frames=range(1, num_steps + 1), init_func=animation.reset,
+                            interval=500, repeat_delay=1000)
+        plt.show()
+    else:
+        # Every frame is written as soon as it is drawn. Since the layers are rendered on top of the background of the
+        # static content each frame has to contain all layers drawn so far.
+        with FrameExporter(fig, output_path, fps=2) as exporter:
+            for step in range(1, num_steps + 1):
+                animation.update(step)
+                exporter.write_frame([artist for artist in animation.layers + [animation.boundary]
+                                      if artist is not None])
+
+    if animation.union is not None:
+        print("Drivable area: " + str(animation.union.area))
 
 
 if __name__ == '__main__':
@@ -6,17 +6,21 @@ from typing import List
 from numpy.ma import array
 
 from common import load_scenario, VehicleInfo, MyState
+from common.compiled import CompiledScenario
 from common.optimizer import optimized_scenario
 
 
 def main() -> None:
     scenario, planning_problem = load_scenario('scenarios/DEU_B471-1_1_T-1_mod.xml')
+    # The optimizer generates states repeatedly so all indices and the goal region are built only once in advance
+    compiled_scenario: CompiledScenario = CompiledScenario(scenario, planning_problem)
 
     start_time: datetime = datetime.now()
     ego_vehicle: MyState = MyState(copy(planning_problem.initial_state))
     vehicles: List[VehicleInfo] = [VehicleInfo(ego_vehicle, -1)]
 
-    optimized_scenario(vehicles, 3000, 10, 10, array([10, 9, 8, 7, 6, 5, 4, 3, 2, 1]), scenario, planning_problem)
+    optimized_scenario(vehicles, 3000, 10, 10, array([10, 9, 8, 7, 6, 5, 4, 3, 2, 1]), compiled_scenario,
+                       planning_problem)
 
     print("Optimization in " + str(datetime.now() - start_time))
     print("Optimized velocity: " + str(planning_problem.initial_state.velocity))
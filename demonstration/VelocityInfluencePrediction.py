@@ -1,94 +1,222 @@
-from copy import copy
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed, Future
 from datetime import datetime
-from typing import List, Dict, TextIO
+from typing import List, Dict, Any, Optional
+
+import matplotlib
+
+matplotlib.use('Agg')  # Render without any display so frames can be rendered by worker processes
 
 import matplotlib.pyplot as plt
+from matplotlib.axes import Axes
+from matplotlib.figure import Figure
 from numpy.core.multiarray import arange
 from shapely.geometry import MultiPolygon
+from shapely.geometry.base import BaseGeometry
+from shapely.ops import unary_union
 
-from common import load_scenario, DrawHelp, MyState, flatten_dict_values, VehicleInfo, drawable_types, DrawConfig
+from common import load_scenario, preload_scenario, DrawHelp, MyState, flatten_dict_values, VehicleInfo, DrawConfig
+from common.cache import GenerationCache
 from common.generation import GenerationHelp, GenerationConfig
+from common.optimizer import calculate_layer_unions
+
+scenario_path: str = 'scenarios/DEU_B471-1_1_T-1_mod_2.xml'
+num_time_steps: int = 15
+min_velocity: int = 40
+max_velocity: int = 59
+velocity_step_size: float = 0.1
+results_path: str = "velocity_sweep.jsonl"  # Every completed velocity is appended as a single JSON line
+cache_dir: str = "velocity_sweep_cache"  # Generated states are stored here so rendering does not generate them again
+num_workers: int = os.cpu_count() or 1
+num_threads: int = 1  # The number of processes each worker generates states with (See GenerationConfig.num_threads)
+
+# Per worker process state which is set up by init_worker()
+_scenario = None
+_planning_problem = None
+_figure: Optional[Figure] = None
+_scenario_fig: Optional[Axes] = None
+_area_fig: Optional[Axes] = None
+
+
+def frame_path(velocity: float) -> str:
+    return "out_velocity_{:.1f}.png".format(velocity)
+
+
+def init_worker() -> None:
+    """
+    Loads the scenario once per worker process. By default each worker generates states using a single process since
+    the velocities are already processed in parallel.
+    """
+    global _scenario, _planning_problem
+    _scenario, _planning_problem = load_scenario(scenario_path)
+    GenerationConfig.num_threads = num_threads
+    GenerationConfig.cache = GenerationCache(memory_entries=4, cache_dir=cache_dir, max_disk_bytes=1024 * 1024 * 1024)
+
+
+def generate_states(velocity: float) -> Dict[int, List[VehicleInfo]]:
+    _planning_problem.initial_state.velocity = velocity
+    valid_converted, _ \
+        = GenerationHelp.generate_states(_scenario, MyState(_planning_problem.initial_state), num_time_steps)
+    return valid_converted
+
+
+def process_velocity(velocity: float) -> Dict[str, Any]:
+    """
+    Generates all states for the given initial velocity of the ego vehicle and measures the resulting drivable area.
+    :return: The measurements of the given velocity.
+    """
+    cache: GenerationCache = GenerationConfig.cache
+    num_hits: int = cache.memory_hits + cache.disk_hits
+    start_time: datetime = datetime.now()
+    all_states: List[VehicleInfo] = flatten_dict_values(generate_states(velocity))
+    generation_time: float = (datetime.now() - start_time).total_seconds()
+    # NOTE If the states were cached (E.g. by a previous sweep) the generation time only measures the lookup
+    cache_hit: bool = cache.memory_hits + cache.disk_hits > num_hits
+    union: BaseGeometry = MultiPolygon() if not all_states \
+        else unary_union(list(calculate_layer_unions(all_states).values()))
+    return {
+        'velocity': velocity,
+        'area': union.area,
+        'num_states': len(all_states),
+        'generation_time': generation_time,
+        'cache_hit': cache_hit,
+        'total_time': (datetime.now() - start_time).total_seconds()
+    }
+
+
+def _remove(artist) -> None:
+    if isinstance(artist, list):
+        for a in artist:
+            _remove(a)
+    elif artist is not None:
+        artist.remove()
+
+
+def render_velocity(velocity: float, drivable_areas: Dict[float, float]) -> str:
+    """
+    Renders the frame of the given velocity. The figure and everything drawn independently of the velocity is created
+    only once per worker process.
+    :param velocity: The velocity to render the frame for.
+    :param drivable_areas: The drivable areas of all velocities.
+    :return: The path of the saved frame.
+    """
+    global _figure, _scenario_fig, _area_fig
+    if _figure is None:
+        _figure, (_scenario_fig, _area_fig) = plt.subplots(nrows=1, ncols=2, figsize=(19.20, 10.80), dpi=100)
+        _figure.suptitle("Influence of velocity to drivable area", fontsize=32)
+        plt.sca(_scenario_fig)
+        for obj in [_scenario.lanelet_network, _planning_problem.initial_state]:
+            DrawHelp.draw(DrawHelp.convert_to_drawable(obj))
+        for time_step in range(1, num_time_steps + 1):
+            for obs in _scenario.static_obstacles:
+                DrawHelp.draw(DrawHelp.convert_to_drawable([obs.occupancy_at_time(time_step)]))
+            for obs in _scenario.dynamic_obstacles:
+                DrawHelp.draw(DrawHelp.convert_to_drawable([obs.occupancy_at_time(time_step)]))
+        _scenario_fig.set_aspect('equal')
+        _scenario_fig.set_xlim([100, 200])
+        _scenario_fig.set_ylim([30, 100])
+        _scenario_fig.set_xlabel("position [m]")
+        _scenario_fig.set_ylabel("position [m]")
+
+    # Draw states resulting from the current velocity of the ego vehicle
+    plt.sca(_scenario_fig)
+    all_states: List[VehicleInfo] = flatten_dict_values(generate_states(velocity))
+    artists: list = [DrawHelp.draw_vehicles(all_states)]
+    if all_states:
+        artists.append(DrawHelp.draw_geometries([unary_union(list(calculate_layer_unions(all_states).values()))]))
+
+    # Draw changes of drivable area up to the current velocity
+    velocities: List[float] = sorted(v for v in drivable_areas.keys() if v <= velocity)
+    areas: List[float] = [drivable_areas[v] for v in velocities]
+    _area_fig.cla()
+    _area_fig.set_xlim([min_velocity, max_velocity])
+    _area_fig.set_ylim([0, max([270.0] + list(drivable_areas.values()))])
+    _area_fig.plot(velocities, areas, 'x', velocities, areas, '-')
+    _area_fig.set_xlabel("velocity [m/s]")
+    _area_fig.set_ylabel("area [m²]")
+
+    _figure.savefig(frame_path(velocity))
+    _remove(artists)
+    return frame_path(velocity)
+
+
+def load_results(path: str) -> Dict[float, Dict[str, Any]]:
+    """
+    Reads the results of a previous (possibly partial) sweep.
+    :return: A dictionary mapping the velocities to their results.
+    """
+    results: Dict[float, Dict[str, Any]] = {}
+    if os.path.exists(path):
+        with open(path) as results_file:
+            for line in results_file:
+                if line.strip():
+                    try:
+                        result: Dict[str, Any] = json.loads(line)
+                    except ValueError:
+                        continue  # E.g. the last line if a previous sweep was interrupted while writing it
+                    results[result['velocity']] = result
+    return results
+
+
+def terminate_last_line(path: str) -> None:
+    """
+    Appends a line break if the last line of the given file is incomplete. (E.g. since a previous sweep was interrupted
+    while writing it) Otherwise the next result would be appended to that line.
+    """
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, "rb+") as file:
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b"\n":
+                file.write(b"\n")
 
 
 def main() -> None:
-    scenario, planning_problem = load_scenario('scenarios/DEU_B471-1_1_T-1_mod_2.xml')
-
-    num_time_steps: int = 15
-    fixed_drawables: List[drawable_types] = []
-    for obj in [scenario.lanelet_network, planning_problem.initial_state]:
-        fixed_drawables.append(DrawHelp.convert_to_drawable(obj))
-    for time_step in range(1, num_time_steps + 1):
-        for obs in scenario.static_obstacles:
-            fixed_drawables.append(DrawHelp.convert_to_drawable([obs.occupancy_at_time(time_step)]))
-        for obs in scenario.dynamic_obstacles:
-            fixed_drawables.append(DrawHelp.convert_to_drawable([obs.occupancy_at_time(time_step)]))
-
-    min_velocity: int = 40
-    max_velocity: int = 59
-    velocity_step_size: float = 0.1
-    drivable_areas: Dict[int, float] = {}
-
-    config_file: TextIO = open("config.conf", "w")
-    config_file.write("Velocities from " + str(min_velocity) + " to " + str(max_velocity))
-    config_file.write("num_time_steps: " + str(num_time_steps))
-    config_file.write("time_step_size: " + str(scenario.dt))
-    config_file.write("GenerationConfig.max_yaw: " + str(GenerationConfig.max_yaw))
-    config_file.write("GenerationConfig.yaw_steps: " + str(GenerationConfig.yaw_steps))
-    config_file.write("GenerationConfig.num_threads: " + str(GenerationConfig.num_threads))
-    config_file.write("GenerationConfig.position_threshold: " + str(GenerationConfig.position_threshold))
-    config_file.write("GenerationConfig.angle_threshold: " + str(GenerationConfig.angle_threshold))
-    config_file.write("DrawConfig.car_length: " + str(DrawConfig.car_length))
-    config_file.write("DrawConfig.car_width: " + str(DrawConfig.car_width))
-    config_file.close()
+    # The forked workers share the loaded scenario instead of reading it again
+    scenario, _ = preload_scenario(scenario_path)
+    with open("config.conf", "w") as config_file:
+        config_file.write("Velocities from " + str(min_velocity) + " to " + str(max_velocity) + "\n")
+        config_file.write("num_time_steps: " + str(num_time_steps) + "\n")
+        config_file.write("time_step_size: " + str(scenario.dt) + "\n")
+        config_file.write("GenerationConfig.max_yaw: " + str(GenerationConfig.max_yaw) + "\n")
+        config_file.write("GenerationConfig.yaw_steps: " + str(GenerationConfig.yaw_steps) + "\n")
+        config_file.write("GenerationConfig.num_threads: " + str(num_threads) + "\n")
+        config_file.write("num_workers: " + str(num_workers) + "\n")
+        config_file.write("GenerationConfig.position_threshold: " + str(GenerationConfig.position_threshold) + "\n")
+        config_file.write("GenerationConfig.angle_threshold: " + str(GenerationConfig.angle_threshold) + "\n")
+        config_file.write("DrawConfig.car_length: " + str(DrawConfig.car_length) + "\n")
+        config_file.write("DrawConfig.car_width: " + str(DrawConfig.car_width) + "\n")
+
+    velocities: List[float] = [round(float(v), 1) for v
+                               in arange(min_velocity, max_velocity + velocity_step_size, velocity_step_size)]
+    results: Dict[float, Dict[str, Any]] = load_results(results_path)
+    if results:
+        print("Resuming sweep with " + str(len(results)) + " velocities already processed")
 
     overall_time: datetime = datetime.now()
-    for velocity in arange(min_velocity, max_velocity + velocity_step_size, velocity_step_size):
-        print("Velocity: " + str(velocity))
-
-        # Prepare figure and subplots
-        main_fig, (scenario_fig, area_fig) = plt.subplots(nrows=1, ncols=2, figsize=(19.20, 10.80), dpi=100)
-        main_fig.suptitle("Influence of velocity to drivable area", fontsize=32)
-        plt.sca(scenario_fig)
-
-        # Draw artists to be shown always
-        for fixed in fixed_drawables:
-            DrawHelp.draw(copy(fixed))
-
-        # Generate and draw states resulting from the current velocity of the ego vehicle
-        planning_problem.initial_state.velocity = velocity
-        start_time: datetime = datetime.now()
-        valid_converted, num_states_processed \
-            = GenerationHelp.generate_states(scenario, MyState(planning_problem.initial_state), num_time_steps)
-        print("Processed " + str(num_states_processed) + " states in " + str(datetime.now() - start_time))
-
-        all_states: List[VehicleInfo] = flatten_dict_values(valid_converted)
-
-        for vehicle in all_states:
-            DrawHelp.draw(vehicle.drawable)
-
-        union: MultiPolygon = DrawHelp.union_to_polygon(list(map(lambda v: v.drawable, all_states)))
-        DrawHelp.draw(union)
-        drivable_areas[velocity] = union.area
-
-        scenario_fig.set_aspect('equal')
-        scenario_fig.set_xlim([100, 200])
-        scenario_fig.set_ylim([30, 100])
-        scenario_fig.set_xlabel("position [m]")
-        scenario_fig.set_ylabel("position [m]")
-
-        # Draw changes of drivable area
-        area_fig.set_xlim([min_velocity, max_velocity])
-        area_fig.set_ylim([0, max(270.0, max(drivable_areas.values()))])
-        area_fig.plot(drivable_areas.keys(), drivable_areas.values(), 'x',
-                      drivable_areas.keys(), drivable_areas.values(), '-')
-        area_fig.set_xlabel("velocity [m/s]")
-        area_fig.set_ylabel("area [m²]")
-
-        # Save the figure
-        plt.savefig("out_velocity_" + str(velocity) + ".png")
-        # plt.close()  # FIXME Causes EOFErrors
-
-    print("Overall generation took: " + str(datetime.now() - overall_time))
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=init_worker) as executor:
+        # Generate states of all velocities and stream their results
+        terminate_last_line(results_path)
+        with open(results_path, "a") as results_file:
+            futures: List[Future] \
+                = [executor.submit(process_velocity, v) for v in velocities if v not in results]
+            for future in as_completed(futures):
+                result: Dict[str, Any] = future.result()
+                results[result['velocity']] = result
+                results_file.write(json.dumps(result) + "\n")
+                results_file.flush()
+                print("Velocity " + str(result['velocity']) + ": " + str(result['num_states']) + " states in "
+                      + str(result['generation_time']) + "s" + (" (cached)" if result['cache_hit'] else "")
+                      + ", area " + str(result['area']))
+
+        # Render frames of all velocities
+        drivable_areas: Dict[float, float] = {v: r['area'] for v, r in results.items()}
+        futures = [executor.submit(render_velocity, v, drivable_areas) for v in velocities
+                   if not os.path.exists(frame_path(v))]
+        for future in as_completed(futures):
+            print("Rendered " + future.result())
+
+    print("Overall sweep took: " + str(datetime.now() - overall_time))
 
 
 if __name__ == '__main__':
@@ -3,29 +3,32 @@ from queue import Queue
 
 from commonroad.scenario.trajectory import State
 
+from common.StatesIndex import StatesIndex
+
 
 class PriorityStatesQueue(Queue):
     """
     Implements a priority queue for states. To reduce the memory consumption a high time_step value indicates a high
-    priority. NOTE It is likely to be much slower than the StatesQueue.
+    priority. A state is contained if it is close to any state ever put into the queue. This includes states which were
+    already taken from the queue. NOTE It is likely to be much slower than the StatesQueue.
     """
 
     def __init__(self, position_threshold: float, angle_threshold: float):
         super().__init__()
         self.queue = []
         self.index = 0
+        self.states_index = StatesIndex(position_threshold, angle_threshold)
         self.position_threshold = position_threshold
         self.angle_threshold = angle_threshold
 
     def _put(self, item: State):
         heapq.heappush(self.queue, (-item.time_step, self.index, item))
         self.index += 1
+        self.states_index.add(item.position[0], item.position[1], item.orientation)
 
     def _get(self):
         return heapq.heappop(self.queue)[-1]
 
     def __contains__(self, item: State):
         with self.mutex:
-            return any(map(
-                lambda s: all(abs(s[2].position - item.position) <= self.position_threshold)
-                          and abs(s[2].orientation - item.orientation) <= self.angle_threshold, self.queue))
+            return self.states_index.contains(item.position[0], item.position[1], item.orientation)
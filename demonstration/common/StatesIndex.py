@@ -0,0 +1,54 @@
+from math import floor
+from typing import Dict, List, Tuple
+
+
+class StatesIndex:
+    """
+    Implements a grid based index over the positions and orientations of states. The size of each cell equals the given
+    thresholds. Therefore all states which are close to a given state lie either in its cell or in one of the neighbour
+    cells.
+    """
+
+    def __init__(self, position_threshold: float, angle_threshold: float):
+        self.cells: Dict[Tuple[int, int, int], List[Tuple[float, float, float]]] = {}
+        self.size = 0
+        self.position_threshold = position_threshold
+        self.angle_threshold = angle_threshold
+
+    def _cell(self, x: float, y: float, orientation: float) -> Tuple[int, int, int]:
+        return floor(x / self.position_threshold), floor(y / self.position_threshold), \
+               floor(orientation / self.angle_threshold)
+
+    def add(self, x: float, y: float, orientation: float) -> None:
+        """
+        Adds the given position and orientation to the index.
+        :param x: The x coordinate of the position.
+        :param y: The y coordinate of the position.
+        :param orientation: The orientation in radians.
+        """
+        self.cells.setdefault(self._cell(x, y, orientation), []).append((x, y, orientation))
+        self.size += 1
+
+    def contains(self, x: float, y: float, orientation: float) -> bool:
+        """
+        Checks whether the index contains a position and orientation which is close to the given one.
+        :param x: The x coordinate of the position.
+        :param y: The y coordinate of the position.
+        :param orientation: The orientation in radians.
+        :return: True only if there is a position whose coordinates differ at most by position_threshold and whose
+        orientation differs at most by angle_threshold.
+        """
+        cell_x, cell_y, cell_orientation = self._cell(x, y, orientation)
+        for neighbour_x in range(cell_x - 1, cell_x + 2):
+            for neighbour_y in range(cell_y - 1, cell_y + 2):
+                for neighbour_orientation in range(cell_orientation - 1, cell_orientation + 2):
+                    for other_x, other_y, other_orientation \
+                            in self.cells.get((neighbour_x, neighbour_y, neighbour_orientation), ()):
+                        if abs(other_x - x) <= self.position_threshold \
+                                and abs(other_y - y) <= self.position_threshold \
+                                and abs(other_orientation - orientation) <= self.angle_threshold:
+                            return True
+        return False
+
+    def __len__(self) -> int:
+        return self.size
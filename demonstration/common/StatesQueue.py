@@ -1,23 +1,29 @@
 from queue import Queue
 
 from common import MyState
+from common.StatesIndex import StatesIndex
 
 
 class StatesQueue(Queue):
+    """
+    Implements a queue for states. A state is contained if it is close to any state ever put into the queue. This
+    includes states which were already taken from the queue.
+    """
+
     def __init__(self, position_threshold: float, angle_threshold: float):
         super().__init__()
         self.queue = set()
+        self.index = StatesIndex(position_threshold, angle_threshold)
         self.position_threshold = position_threshold
         self.angle_threshold = angle_threshold
 
     def _put(self, item: MyState):
         self.queue.add(item)
+        self.index.add(item.state.position[0], item.state.position[1], item.state.orientation)
 
     def _get(self):
         return self.queue.pop()
 
     def __contains__(self, item: MyState):
         with self.mutex:
-            return any(map(
-                lambda s: all(abs(s.state.position - item.state.position) <= self.position_threshold)
-                          and abs(s.state.orientation - item.state.orientation) <= self.angle_threshold, self.queue))
+            return self.index.contains(item.state.position[0], item.state.position[1], item.state.orientation)
@@ -0,0 +1,128 @@
+from ctypes import c_char, c_int, c_bool
+from multiprocessing import Condition, RawArray, RawValue
+from typing import Optional, Dict, List
+
+import numpy as np
+from commonroad.scenario.trajectory import State
+
+from common import MyState, VehicleInfo
+from common.StatesIndex import StatesIndex
+
+# NOTE parent_id is -1 for the initial state
+record_dtype: np.dtype = np.dtype([('time_step', np.int32), ('x', np.float64), ('y', np.float64),
+                                   ('orientation', np.float64), ('velocity', np.float64), ('parent_id', np.int32)])
+
+
+class StatesStore:
+    """
+    Stores states as fixed size records in shared memory. Forked processes share the records without pickling any of
+    them. The records are also used as the frontier of the generation: Every record is handed out once by claim(...) in
+    the order the records were added.
+    """
+
+    def __init__(self, capacity: int, position_threshold: float, angle_threshold: float):
+        self.capacity = capacity
+        self._buffer = RawArray(c_char, capacity * record_dtype.itemsize)
+        self.records: np.ndarray = np.frombuffer(self._buffer, dtype=record_dtype)
+        self._size = RawValue(c_int, 0)
+        self._next = RawValue(c_int, 0)
+        self._in_flight = RawValue(c_int, 0)
+        self._overflow = RawValue(c_bool, False)
+        self._condition = Condition()
+        # NOTE The index is local to each process. It is synchronized with the shared records before being queried.
+        self._index = StatesIndex(position_threshold, angle_threshold)
+        self._indexed = 0
+
+    @property
+    def size(self) -> int:
+        return self._size.value
+
+    @property
+    def overflow(self) -> bool:
+        """
+        :return: True only if any record could not be added since the capacity of the store was exceeded.
+        """
+        return self._overflow.value
+
+    def _sync_index(self) -> None:
+        size: int = self._size.value
+        for i in range(self._indexed, size):
+            record = self.records[i]
+            self._index.add(record['x'], record['y'], record['orientation'])
+        self._indexed = size
+
+    def contains(self, x: float, y: float, orientation: float) -> bool:
+        """
+        Checks whether there is a record which is close to the given position and orientation. (See StatesIndex)
+        """
+        self._sync_index()
+        return self._index.contains(x, y, orientation)
+
+    def append(self, time_step: int, x: float, y: float, orientation: float, velocity: float, parent_id: int,
+               skip_duplicate: bool = True) -> int:
+        """
+        Adds a new record.
+        :param skip_duplicate: If True the record is only added if there is no record close to it.
+        :return: The id of the new record or -1 if it was not added.
+        """
+        with self._condition:
+            if skip_duplicate and self.contains(x, y, orientation):
+                return -1
+            size: int = self._size.value
+            if size >= self.capacity:
+                self._overflow.value = True
+                return -1
+            self.records[size] = (time_step, x, y, orientation, velocity, parent_id)
+            self._size.value = size + 1
+            self._condition.notify_all()
+            return size
+
+    def claim(self) -> Optional[int]:
+        """
+        Returns the id of the next record to expand. Blocks if there is currently no record left to expand but other
+        processes are still expanding records. Every claimed record has to be released using done(...).
+        :return: The id of the record to expand or None if all records are expanded.
+        """
+        with self._condition:
+            while True:
+                if self._next.value < self._size.value:
+                    record_id: int = self._next.value
+                    self._next.value += 1
+                    self._in_flight.value += 1
+                    return record_id
+                if self._in_flight.value == 0:
+                    return None
+                self._condition.wait()
+
+    def done(self, record_id: int) -> None:
+        """
+        Marks the given claimed record as expanded.
+        """
+        with self._condition:
+            self._in_flight.value -= 1
+            self._condition.notify_all()
+
+    @staticmethod
+    def to_state(record: np.void) -> MyState:
+        """
+        Creates a new state from the given record.
+        """
+        return MyState(State(position=np.array([record['x'], record['y']]), orientation=float(record['orientation']),
+                             velocity=float(record['velocity']), time_step=int(record['time_step'])))
+
+    @staticmethod
+    def to_vehicle_infos(records: np.ndarray, time_steps: int) -> Dict[int, List[VehicleInfo]]:
+        """
+        Creates the vehicle infos for all the given records except the initial state.
+        :param records: The records to convert.
+        :param time_steps: The number of steps which were simulated.
+        :return: A dictionary mapping a time step to all states of that time step.
+        """
+        vehicle_infos: Dict[int, List[VehicleInfo]] = {}
+        for step in range(1, time_steps + 1):
+            vehicle_infos[step] = []
+        for record in records:
+            if record['parent_id'] > -1:
+                vehicle_infos.setdefault(int(record['time_step']), []) \
+                    .append(VehicleInfo(StatesStore.to_state(record), None))
+        return vehicle_infos
@@ -1,14 +1,20 @@
 import os
+import pickle
+from copy import copy
+from hashlib import sha1
+from logging import warning
 from typing import Tuple, Optional, List, Dict, TypeVar, Any
 
 import numpy as np
 from commonroad.common.file_reader import CommonRoadFileReader
-from commonroad.planning.planning_problem import PlanningProblem
+from commonroad.planning.planning_problem import PlanningProblem, PlanningProblemSet
 from commonroad.scenario.scenario import Scenario
 from commonroad.scenario.trajectory import State
 
 from common.coords import CoordsHelp
 from common.draw import DrawConfig, DrawHelp
+from common.grid import GridConfig, OccupancyGrid
+from common.index import RoadIndex, ObstacleIndex
 from common.types import drawable_types
 
 _T = TypeVar('_T')
@@ -22,6 +28,17 @@ class MyState(object):
     def __init__(self, state: State):
         self.state = state
 
+    def copy(self) -> 'MyState':
+        """
+        Returns a copy of this state. In contrast to deepcopy(...) only the position is copied besides the state itself
+        since all other attributes of a state are immutable numbers.
+        :return: The copy of this state.
+        """
+        state: State = copy(self.state)
+        if isinstance(state.position, np.ndarray):
+            state.position = state.position.copy()
+        return MyState(state)
+
     def variable(self, j: int) -> Any:
         """
         Returns the jth variable of this state.
@@ -60,14 +77,34 @@ class VehicleInfo(object):
         :param dynamic_obs_index: The index within the dynamic obstacles list attached to the scenario. -1 represents
         the ego vehicle shipped with the planning problem. None represents a VehicleInfo that does not represent an
         initial state.
-        :param drawable: The drawable representing the car. If None is passed the drawable representation is generated.
+        :param drawable: The drawable representing the car. If None is passed the drawable representation is generated
+        on the first access of drawable.
         """
         self.state = state
         self.dynamic_obs_index = dynamic_obs_index
-        if drawable:
-            self.drawable = drawable
-        else:
-            self.drawable = DrawHelp.convert_to_drawable(state)
+        self._drawable = drawable
+        self._footprint: Optional[np.ndarray] = None
+
+    @property
+    def drawable(self) -> drawable_types:
+        if self._drawable is None:
+            self._drawable = DrawHelp.convert_to_drawable(self.state)
+        return self._drawable
+
+    @drawable.setter
+    def drawable(self, drawable: drawable_types) -> None:
+        self._drawable = drawable
+
+    @property
+    def footprint(self) -> np.ndarray:
+        """
+        :return: The corner positions of the car in anti-clockwise order as array of shape (4, 2). (See
+        CoordsHelp.get_all_pos_batch(...))
+        """
+        if self._footprint is None:
+            self._footprint = CoordsHelp.get_all_pos_batch(
+                self.state.state.position, self.state.state.orientation, DrawConfig.car_length, DrawConfig.car_width)[0]
+        return self._footprint
 
 
 def flatten_dict_values(dictionary: Dict[Any, List[_T]]) -> List[_T]:
@@ -79,17 +116,103 @@ def flatten_dict_values(dictionary: Dict[Any, List[_T]]) -> List[_T]:
     return [item for sublist in dictionary.values() for item in sublist]
 
 
+class ScenarioCacheConfig:
+    enabled: bool = True  # If True load_scenario(...) reuses parsed scenarios as long as their files do not change
+    cache_dir: Optional[str] = None  # If None the parsed scenarios are stored in __pycache__ next to their files
+
+
+# Maps the absolute paths of preloaded files to the scenarios and planning problems read from them
+_preloaded_scenarios: Dict[str, Tuple[Scenario, PlanningProblem]] = {}
+
+
+def _scenario_cache_path(scenario_path: str) -> str:
+    cache_dir: str = ScenarioCacheConfig.cache_dir \
+        if ScenarioCacheConfig.cache_dir else os.path.join(os.path.dirname(scenario_path), "__pycache__")
+    return os.path.join(cache_dir, os.path.basename(scenario_path) + ".pickle")
+
+
+def _write_scenario_cache(scenario_path: str, stat: os.stat_result, content_hash: str,
+                          content: Tuple[Scenario, PlanningProblemSet]) -> None:
+    """
+    Stores the parsed content of the given common road file along with the modification time, the size and the hash of
+    the file it was parsed from.
+    """
+    cache_path: str = _scenario_cache_path(scenario_path)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temp_path: str = cache_path + "." + str(os.getpid())
+        with open(temp_path, "wb") as cache_file:
+            pickle.dump({'mtime': stat.st_mtime_ns, 'size': stat.st_size, 'hash': content_hash, 'content': content},
+                        cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)  # Concurrent readers never see a partially written pickle
+    except OSError as e:
+        warning("Could not cache the scenario " + scenario_path + " (" + str(e) + ").")
+
+
+def _read_scenario(scenario_path: str) -> Tuple[Scenario, PlanningProblemSet]:
+    """
+    Reads the given common road file. If ScenarioCacheConfig.enabled is set the parsed file is stored as pickle and
+    used instead of parsing the file again as long as the file does not change. A changed modification time only
+    invalidates the pickle if the content of the file changed as well.
+    """
+    if not ScenarioCacheConfig.enabled:
+        return CommonRoadFileReader(scenario_path).open()
+
+    stat = os.stat(scenario_path)
+    cache_path: str = _scenario_cache_path(scenario_path)
+    content_hash: Optional[str] = None
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "rb") as cache_file:
+                cached: Dict[str, Any] = pickle.load(cache_file)
+            if cached['mtime'] == stat.st_mtime_ns and cached['size'] == stat.st_size:
+                return cached['content']
+            with open(scenario_path, "rb") as scenario_file:
+                content_hash = sha1(scenario_file.read()).hexdigest()
+            if cached['hash'] == content_hash:
+                # Store the new modification time so the file does not have to be hashed again next time
+                _write_scenario_cache(scenario_path, stat, content_hash, cached['content'])
+                return cached['content']
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError, AttributeError, ImportError) as e:
+            warning("Ignoring the cached scenario " + cache_path + " (" + str(e) + ").")
+
+    content: Tuple[Scenario, PlanningProblemSet] = CommonRoadFileReader(scenario_path).open()
+    if content_hash is None:
+        with open(scenario_path, "rb") as scenario_file:
+            content_hash = sha1(scenario_file.read()).hexdigest()
+    _write_scenario_cache(scenario_path, stat, content_hash, content)
+    return content
+
+
+def preload_scenario(path: str) -> Tuple[Scenario, PlanningProblem]:
+    """
+    Loads the given common road scenario once. Later calls of load_scenario(...) with the same path return the same
+    objects instead of loading the file again. Preloading a scenario before forking worker processes shares it with
+    all of them without any worker reading the file. The returned objects are shared so they should not be modified
+    unless they are used by a single process only.
+    :param path: The relative path to the common road file to load. (See load_scenario(...))
+    :return: A tuple returning the loaded scenario and the first planning problem found.
+    """
+    scenario_path: str = os.path.abspath(os.path.join(os.getcwd(), path))
+    _preloaded_scenarios.pop(scenario_path, None)
+    _preloaded_scenarios[scenario_path] = load_scenario(path)
+    return _preloaded_scenarios[scenario_path]
+
+
 def load_scenario(path: str) -> Tuple[Scenario, PlanningProblem]:
     """
     Loads the given common road scenario.
     :param path: The relative path to the common road file to load. The base of the relative path is based on
     os.getcwd().
     :type path: str
-    :return: A tuple returning the loaded scenario and the first planning problem found.
+    :return: A tuple returning the loaded scenario and the first planning problem found. If the scenario was preloaded
+    the objects returned by preload_scenario(...) are returned. (See preload_scenario(...))
     """
     scenario_path: os.path = os.path.join(os.getcwd(), path)
-    scenario, planning_problem_set = CommonRoadFileReader(scenario_path) \
-        .open()
+    preloaded: Optional[Tuple[Scenario, PlanningProblem]] = _preloaded_scenarios.get(os.path.abspath(scenario_path))
+    if preloaded is not None:
+        return preloaded
+    scenario, planning_problem_set = _read_scenario(scenario_path)
     if planning_problem_set:
         for _, planning_problem in planning_problem_set.planning_problem_dict.items():
             return scenario, planning_problem
@@ -98,20 +221,54 @@ def load_scenario(path: str) -> Tuple[Scenario, PlanningProblem]:
 def is_valid(vehicle: VehicleInfo, scenario: Scenario) -> Optional[bool]:
     """
     Checks whether the given position is valid position within the scenario. A position is valid only if there is no
-    collision with other traffic participants or any obstacles.
+    collision with other traffic participants or any obstacles. If GridConfig.enabled is set the check uses the
+    OccupancyGrid of the scenario instead of the exact geometries.
     :param vehicle: The vehicle to check.
     :param scenario: The scenario where the position and intersection of the object has to be checked in.
     :return True only if all the given positions are allowed in terms of collision freedom in the scenario.
     """
-    positions: List[Tuple[float, float]] \
-        = CoordsHelp.get_all_pos(vehicle.drawable, DrawConfig.car_length, DrawConfig.car_width)
-    # noinspection PyTypeChecker
-    lanes: List[List[int]] = scenario.lanelet_network.find_lanelet_by_position(np.array(positions))
-    is_within_lane: bool = all(map(lambda lane: lane != [], lanes))
-    intersects_with_obstacle: bool = False
-    for obstacle in scenario.obstacles:
-        if any(map(lambda pos: obstacle.occupancy_at_time(vehicle.state.state.time_step)
-                .shape.contains_point(np.array(pos)), positions)):
-            intersects_with_obstacle = True
-            break
-    return is_within_lane and not intersects_with_obstacle
+    return bool(are_valid(vehicle.footprint[np.newaxis], vehicle.state.state.time_step, scenario)[0])
+
+
+def are_valid(positions: np.ndarray, time_step: int, scenario: Scenario) -> np.ndarray:
+    """
+    Checks for many vehicles at once whether they are at a valid position within the scenario. The checks equal the
+    ones of is_valid(...).
+    :param positions: The corner positions of all vehicles to check as array of shape (N, 4, 2). (See
+    CoordsHelp.get_all_pos_batch(...))
+    :param time_step: The time step whose occupancies of obstacles have to be considered.
+    :param scenario: The scenario where the positions and intersection of the objects have to be checked in.
+    :return: An array of shape (N,) which is True for all vehicles which have a valid position.
+    """
+    positions = np.asarray(positions, dtype=float).reshape(-1, 4, 2)
+    if len(positions) == 0:
+        return np.zeros(0, dtype=bool)
+    return are_on_road(positions, scenario) & ~are_colliding(positions, time_step, scenario)
+
+
+def are_on_road(positions: np.ndarray, scenario: Scenario) -> np.ndarray:
+    """
+    Checks for many vehicles at once whether they are completely on the lanelets of the scenario. (First part of
+    are_valid(...))
+    :param positions: The corner positions of all vehicles to check as array of shape (N, 4, 2).
+    :param scenario: The scenario whose lanelets have to be considered.
+    :return: An array of shape (N,) which is True for all vehicles which are on the road.
+    """
+    positions = np.asarray(positions, dtype=float).reshape(-1, 4, 2)
+    if GridConfig.enabled:
+        return OccupancyGrid.of(scenario).contains(positions)
+    return RoadIndex.of(scenario).contains(positions)
+
+
+def are_colliding(positions: np.ndarray, time_step: int, scenario: Scenario) -> np.ndarray:
+    """
+    Checks for many vehicles at once whether they collide with any obstacle. (Second part of are_valid(...))
+    :param positions: The corner positions of all vehicles to check as array of shape (N, 4, 2).
+    :param time_step: The time step whose occupancies of obstacles have to be considered.
+    :param scenario: The scenario whose obstacles have to be considered.
+    :return: An array of shape (N,) which is True for all vehicles which collide with any obstacle.
+    """
+    positions = np.asarray(positions, dtype=float).reshape(-1, 4, 2)
+    if GridConfig.enabled:
+        return OccupancyGrid.of(scenario).intersects(positions, time_step)
+    return ObstacleIndex.of(scenario).intersects(positions, time_step)
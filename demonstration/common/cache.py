@@ -0,0 +1,124 @@
+import os
+from collections import OrderedDict
+from logging import warning
+from tempfile import mkstemp
+from typing import Optional, Dict, List, Tuple
+
+import numpy as np
+
+
+class GenerationCache:
+    """
+    Caches generated records (See StatesStore) by a content based key. The most recently used records are kept in
+    memory. If a directory is given all records are additionally stored on disk where the least recently used files are
+    removed as soon as their total size exceeds max_disk_bytes.
+    """
+
+    def __init__(self, memory_entries: int = 64, cache_dir: Optional[str] = None,
+                 max_disk_bytes: int = 256 * 1024 * 1024):
+        self.memory_entries = memory_entries
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._entries: 'OrderedDict[str, np.ndarray]' = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".npy")
+
+    def _remember(self, key: str, records: np.ndarray) -> None:
+        records.flags.writeable = False
+        self._entries[key] = records
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.memory_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """
+        Returns the records stored for the given key.
+        :param key: The key of the records.
+        :return: The read-only records or None if there are no records stored for the key. Files which were removed
+        concurrently or which can not be read are treated like missing records.
+        """
+        if key in self._entries:
+            self.memory_hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        if self.cache_dir and os.path.exists(self._path(key)):
+            try:
+                os.utime(self._path(key))  # Mark as recently used
+                records: np.ndarray = np.load(self._path(key))
+            except FileNotFoundError:
+                pass  # Evicted in the meantime
+            except (OSError, ValueError) as ex:
+                warning("Could not load the stored records " + self._path(key) + ": " + str(ex))
+            else:
+                self.disk_hits += 1
+                self._remember(key, records)
+                return records
+        self.misses += 1
+        return None
+
+    def put(self, key: str, records: np.ndarray) -> None:
+        """
+        Stores the given records for the given key.
+        """
+        self._remember(key, records)
+        if self.cache_dir:
+            # Write to a temporary file first so other processes never load partially written records
+            handle, temporary_path = mkstemp(dir=self.cache_dir, suffix=".npy.tmp")
+            try:
+                with os.fdopen(handle, "wb") as file:
+                    np.save(file, records)
+                os.replace(temporary_path, self._path(key))
+            except OSError as ex:
+                warning("Could not store the records " + self._path(key) + ": " + str(ex))
+                if os.path.exists(temporary_path):
+                    os.remove(temporary_path)
+            self._evict()
+
+    def _evict(self) -> None:
+        files: List[Tuple[float, int, str]] = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npy"):
+                path: str = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue  # Removed by another process in the meantime
+                files.append((stat.st_mtime, stat.st_size, path))
+        total_size: int = sum(map(lambda f: f[1], files))
+        for _, size, path in sorted(files):
+            if total_size <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def clear(self) -> None:
+        """
+        Removes all records from memory and from disk.
+        """
+        self._entries.clear()
+        if self.cache_dir:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".npy"):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+    def statistics(self) -> Dict[str, float]:
+        """
+        :return: The number of hits and misses of this cache and its hit rate.
+        """
+        hits: int = self.memory_hits + self.disk_hits
+        requests: int = hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': hits / requests if requests else 0.0
+        }
@@ -0,0 +1,210 @@
+from typing import List, Optional, Dict, Any
+
+import numpy as np
+from commonroad.geometry.shape import Shape, Rectangle, Circle
+from commonroad.planning.planning_problem import PlanningProblem
+from commonroad.prediction.prediction import Occupancy
+from commonroad.scenario.obstacle import DynamicObstacle
+from commonroad.scenario.scenario import Scenario
+from shapely.geometry import Polygon, Point
+from shapely.geometry.base import BaseGeometry
+from shapely.ops import unary_union
+from shapely.strtree import STRtree
+
+from common.index import RoadIndex, ObstacleIndex, scenario_fingerprint, to_shapely, contains_xy, prepare
+
+
+class CompiledScenario:
+    """
+    Holds everything derived from a scenario and its planning problem which is queried repeatedly. It is built once and
+    accepted in place of the scenario by is_valid(...), are_valid(...), the generation, the optimizer, the grid,
+    dijkstra_search(...) and DrawHelp. They access the indices of the scenario using RoadIndex.of(...),
+    ObstacleIndex.of(...) and OccupancyGrid.of(...) which return the indices held by this object. The obstacle index
+    is built from the table of obstacle centers, orientations and extents and the grid covers the compiled bounds.
+    Everything else is taken from the wrapped scenario. Compiled scenarios can be pickled to transfer them to other
+    processes.
+    """
+    # The kinds of obstacle shapes in obstacle_kinds
+    RECTANGLE: int = 0
+    CIRCLE: int = 1
+    OTHER: int = 2  # Shapes which are not described by the table exactly. Their occupancies are used instead.
+
+    def __init__(self, scenario: Scenario, planning_problem: Optional[PlanningProblem] = None):
+        self.scenario = scenario
+        self.planning_problem = planning_problem
+        self.dt: float = scenario.dt
+        self.fingerprint: str = scenario_fingerprint(scenario)
+
+        # Lanelets
+        self.road_index: RoadIndex = RoadIndex(scenario.lanelet_network)
+        self.lanelet_ids: np.ndarray \
+            = np.array([lanelet.lanelet_id for lanelet in scenario.lanelet_network.lanelets], dtype=int)
+        self.lanelet_polygons: List[np.ndarray] \
+            = [np.asarray(lanelet.convert_to_polygon().vertices, dtype=float)
+               for lanelet in scenario.lanelet_network.lanelets]
+        self.bounds: np.ndarray = np.array(self.road_index.road.bounds, dtype=float)  # min x, min y, max x, max y
+
+        # Obstacles
+        self.obstacle_ids: np.ndarray = np.array([obstacle.obstacle_id for obstacle in scenario.obstacles], dtype=int)
+        self.max_time_step: int = max([0] + [CompiledScenario._last_time_step(obstacle)
+                                             for obstacle in scenario.dynamic_obstacles])
+        self._compile_obstacles()
+        self.obstacle_index: ObstacleIndex = ObstacleIndex(scenario)
+        self._index_obstacles()
+        self.occupancy_grid = None  # Created by OccupancyGrid.of(...) on demand
+
+        # Goal region
+        self.goal: Optional[BaseGeometry] = None
+        if planning_problem is not None:
+            goals: List[BaseGeometry] = [to_shapely(state.position) for state in planning_problem.goal.state_list
+                                         if isinstance(getattr(state, 'position', None), Shape)]
+            self.goal = unary_union(goals) if goals else None
+
+        self._lanelet_tree: Optional[STRtree] = None
+        self._lanelet_shapes: List[Polygon] = []
+        self._prepare()
+
+    @staticmethod
+    def _last_time_step(obstacle: DynamicObstacle) -> int:
+        """
+        :return: The last time step the given obstacle has an occupancy for.
+        """
+        prediction = obstacle.prediction
+        if hasattr(prediction, 'trajectory') and prediction.trajectory.state_list:
+            return prediction.trajectory.state_list[-1].time_step
+        if getattr(prediction, 'occupancy_set', None):
+            return prediction.occupancy_set[-1].time_step
+        return obstacle.initial_state.time_step
+
+    def _compile_obstacles(self) -> None:
+        """
+        Creates the table of the centers and orientations of all obstacles at all time steps. The values of obstacles
+        which are not present at a time step are NaN.
+        """
+        num_steps: int = self.max_time_step + 1
+        num_obstacles: int = len(self.scenario.obstacles)
+        self.obstacle_centers: np.ndarray = np.full((num_steps, num_obstacles, 2), np.nan)
+        self.obstacle_orientations: np.ndarray = np.full((num_steps, num_obstacles), np.nan)
+        # The length and width of each obstacle. The diameter for circles and the extent of the bounding box otherwise.
+        self.obstacle_extents: np.ndarray = np.full((num_obstacles, 2), np.nan)
+        self.obstacle_kinds: np.ndarray = np.full(num_obstacles, CompiledScenario.OTHER, dtype=int)
+        for j, obstacle in enumerate(self.scenario.obstacles):
+            for time_step in range(num_steps):
+                occupancy: Optional[Occupancy] = obstacle.occupancy_at_time(time_step)
+                if occupancy is None:
+                    continue
+                shape: Shape = occupancy.shape
+                if isinstance(shape, Rectangle):
+                    self.obstacle_centers[time_step, j] = shape.center
+                    self.obstacle_orientations[time_step, j] = shape.orientation
+                    self.obstacle_extents[j] = (shape.length, shape.width)
+                    self.obstacle_kinds[j] = CompiledScenario.RECTANGLE
+                elif isinstance(shape, Circle):
+                    self.obstacle_centers[time_step, j] = shape.center
+                    self.obstacle_orientations[time_step, j] = 0
+                    self.obstacle_extents[j] = (2 * shape.radius, 2 * shape.radius)
+                    self.obstacle_kinds[j] = CompiledScenario.CIRCLE
+                else:
+                    min_x, min_y, max_x, max_y = to_shapely(shape).bounds
+                    self.obstacle_centers[time_step, j] = ((min_x + max_x) / 2, (min_y + max_y) / 2)
+                    self.obstacle_orientations[time_step, j] = 0
+                    self.obstacle_extents[j] = (max_x - min_x, max_y - min_y)
+
+    def _index_obstacles(self) -> None:
+        """
+        Fills the obstacle index with the shapes described by the obstacle table for all compiled time steps.
+        """
+        half_lengths: np.ndarray = self.obstacle_extents[:, 0] / 2
+        half_widths: np.ndarray = self.obstacle_extents[:, 1] / 2
+        for time_step in range(self.max_time_step + 1):
+            shapes: List[BaseGeometry] = []
+            for j, obstacle in enumerate(self.scenario.obstacles):
+                if np.isnan(self.obstacle_orientations[time_step, j]):
+                    continue  # Not present at this time step
+                center: np.ndarray = self.obstacle_centers[time_step, j]
+                if self.obstacle_kinds[j] == CompiledScenario.RECTANGLE:
+                    orientation: float = self.obstacle_orientations[time_step, j]
+                    length_vec: np.ndarray = half_lengths[j] * np.array([np.cos(orientation), np.sin(orientation)])
+                    width_vec: np.ndarray = half_widths[j] * np.array([-np.sin(orientation), np.cos(orientation)])
+                    shapes.append(Polygon([center - length_vec - width_vec, center + length_vec - width_vec,
+                                           center + length_vec + width_vec, center - length_vec + width_vec]))
+                elif self.obstacle_kinds[j] == CompiledScenario.CIRCLE:
+                    shapes.append(Point(center).buffer(half_lengths[j]))
+                else:
+                    shapes.append(to_shapely(obstacle.occupancy_at_time(time_step).shape))
+            self.obstacle_index.set_shapes(time_step, shapes)
+
+    def __getattr__(self, name: str) -> Any:
+        # Everything which is not compiled is taken from the scenario itself (E.g. dynamic_obstacles)
+        if name == 'scenario':  # Not set yet while unpickling
+            raise AttributeError(name)
+        return getattr(self.scenario, name)
+
+    def _prepare(self) -> None:
+        if self.goal is not None and prepare:
+            prepare(self.goal)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state: Dict[str, Any] = self.__dict__.copy()
+        state['_lanelet_tree'] = None  # Rebuilt on demand
+        state['_lanelet_shapes'] = []
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._prepare()  # Prepared geometries are not pickled
+
+    @staticmethod
+    def load(path: str) -> 'CompiledScenario':
+        """
+        Loads and compiles the given common road scenario. (See load_scenario(...))
+        """
+        from common import load_scenario
+        scenario, planning_problem = load_scenario(path)
+        return CompiledScenario(scenario, planning_problem)
+
+    @property
+    def lanelet_tree(self) -> STRtree:
+        """
+        :return: The STRtree containing the polygons of all lanelets in the order of lanelet_ids.
+        """
+        if self._lanelet_tree is None:
+            self._lanelet_shapes = [Polygon(vertices) for vertices in self.lanelet_polygons]
+            self._lanelet_tree = STRtree(self._lanelet_shapes)
+        return self._lanelet_tree
+
+    def find_lanelets(self, position: np.ndarray) -> List[int]:
+        """
+        Returns the ids of all lanelets containing the given position.
+        """
+        point: Point = Point(position)
+        candidates = self.lanelet_tree.query(point)
+        if len(candidates) > 0 and not isinstance(candidates[0], BaseGeometry):  # shapely >= 2.0 returns indices
+            indices: List[int] = [int(i) for i in candidates]
+        else:
+            by_id: Dict[int, int] = {id(shape): i for i, shape in enumerate(self._lanelet_shapes)}
+            indices = [by_id[id(shape)] for shape in candidates]
+        return [int(self.lanelet_ids[i]) for i in sorted(indices) if self._lanelet_shapes[i].intersects(point)]
+
+    def goal_contains(self, points: np.ndarray) -> np.ndarray:
+        """
+        Checks which of the given points lie within the goal region of the planning problem.
+        :param points: The points to check as array of shape (..., 2).
+        :return: An array of the shape of points without its last dimension which is True for all points within the
+        goal region.
+        """
+        points = np.asarray(points, dtype=float)
+        if self.goal is None:
+            return np.zeros(points.shape[:-1], dtype=bool)
+        flat_points: np.ndarray = points.reshape(-1, 2)
+        return np.asarray(contains_xy(self.goal, flat_points[:, 0], flat_points[:, 1]), dtype=bool) \
+            .reshape(points.shape[:-1])
+
+    def goal_distance(self, position: np.ndarray) -> float:
+        """
+        :return: The distance of the given position to the goal region of all goal states of the planning problem. The
+        distance of positions within the goal region is 0.
+        """
+        if self.goal_contains(position):
+            return 0.0
+        return Point(position).distance(self.goal)
@@ -1,7 +1,7 @@
 from typing import Tuple, List
 
 from matplotlib.patches import Rectangle
-from numpy import asanyarray, array
+from numpy import asanyarray, array, stack
 from numpy.core.multiarray import ndarray
 from numpy.core.umath import cos, sin, pi, radians, sqrt, square
 
@@ -32,6 +32,32 @@ class CoordsHelp:
         translation_phi: float = pi + orientation + gamma
         return tuple(center_pos + CoordsHelp.pol2cart(translation_rho, translation_phi))
 
+    @staticmethod
+    def get_all_pos_batch(center_pos: ndarray, orientation: ndarray, car_length: float, car_width: float) -> ndarray:
+        """
+        Calculates the corner points of many cars at once. The points equal the ones get_all_pos(...) returns for the
+        drawable of each of the cars.
+        :param center_pos: The center points of the cars as array of shape (N, 2).
+        :param orientation: The orientations of the cars in radians as array of shape (N,).
+        :param car_length: The length of the cars.
+        :param car_width: The width of the cars.
+        :return: The corner positions of all cars in anti-clockwise order as array of shape (N, 4, 2).
+        """
+        center_pos = asanyarray(center_pos, dtype=float).reshape(-1, 2)
+        orientation = asanyarray(orientation, dtype=float).reshape(-1)
+        # See center_to_right_bottom_pos(...)
+        translation_rho: float = 0.5 * sqrt(square(car_length) + square(car_width))
+        gamma: float = cos((0.5 * car_length) / translation_rho)
+        translation_phi: ndarray = pi + orientation + gamma
+        right_bottom_pos: ndarray \
+            = center_pos + translation_rho * stack((cos(translation_phi), sin(translation_phi)), 1)
+        length_vec: ndarray = car_length * stack((cos(orientation), sin(orientation)), 1)
+        width_vec: ndarray = car_width * stack((cos(orientation + pi / 2), sin(orientation + pi / 2)), 1)
+        return stack((right_bottom_pos,
+                      right_bottom_pos + length_vec,
+                      right_bottom_pos + length_vec + width_vec,
+                      right_bottom_pos + width_vec), 1)
+
     @staticmethod
     def get_all_pos(drawable: drawable_types, car_length: float = None, car_width: float = None) \
             -> List[Tuple[float, float]]:
@@ -1,5 +1,5 @@
 from logging import error, warning
-from typing import Optional, List, Tuple, Union
+from typing import Optional, List, Tuple, Union, TYPE_CHECKING
 
 import commonroad
 from commonroad.geometry.shape import Shape
@@ -10,17 +10,23 @@ from commonroad.scenario.scenario import Scenario
 from commonroad.scenario.trajectory import State
 from commonroad.visualization.draw_dispatch_cr import draw_object
 from matplotlib.artist import Artist
+from matplotlib.collections import PolyCollection, LineCollection
 from matplotlib.lines import Line2D
 from matplotlib.patches import Rectangle, Patch
 from matplotlib.pyplot import gca
+from numpy import array, asarray
 from numpy.core.multiarray import ndarray
 from numpy.core.umath import degrees, pi
-from shapely.geometry import MultiPolygon, Polygon, LineString, MultiLineString
+from shapely.geometry import MultiPolygon, Polygon, LineString, MultiLineString, LinearRing
+from shapely.geometry.base import BaseGeometry
 from shapely.ops import unary_union
 
 from common.coords import CoordsHelp
 from common.types import convertible_types, drawable_types
 
+if TYPE_CHECKING:
+    from common import VehicleInfo
+
 
 class DrawConfig:
     shape_params = {
@@ -61,7 +67,10 @@ class DrawHelp:
         :return: The plottable representation of the given object.
         """
         from common import MyState
-        if isinstance(to_draw, (Scenario, LaneletNetwork, Lanelet, StaticObstacle, GoalRegion, List)):  # FIXME Use List[plottable_types]
+        from common.compiled import CompiledScenario
+        if isinstance(to_draw, CompiledScenario):
+            converted = to_draw.scenario
+        elif isinstance(to_draw, (Scenario, LaneletNetwork, Lanelet, StaticObstacle, GoalRegion, List)):  # FIXME Use List[plottable_types]
             converted = to_draw
         elif isinstance(to_draw, DynamicObstacle):
             shape: Shape = to_draw.occupancy_at_time(time_step).shape
@@ -89,6 +98,9 @@ class DrawHelp:
         :param to_draw: The object to draw.
         :return The object drawn on the current plot or None if it could not be drawn.
         """
+        from common.compiled import CompiledScenario
+        if isinstance(to_draw, CompiledScenario):
+            to_draw = to_draw.scenario
         if not to_draw:
             artist = None
         elif isinstance(to_draw, (Scenario, LaneletNetwork, List, GoalRegion, StaticObstacle, commonroad.geometry.shape.Rectangle)):  # FIXME Use List[plottable_types]
@@ -121,6 +133,60 @@ class DrawHelp:
             artist = None
         return artist
 
+    @staticmethod
+    def draw_vehicles(vehicles: List['VehicleInfo']) -> Optional[PolyCollection]:
+        """
+        Draws the outlines of all the given vehicles as a single collection. Like the drawables created by
+        convert_to_drawable(...) each outline is colored based on the time step of the state of the vehicle.
+        :param vehicles: The VehicleInfos to draw.
+        :return The collection drawn on the current plot or None if there are no vehicles.
+        """
+        if not vehicles:
+            return None
+        states: List[State] = [vehicle.state.state for vehicle in vehicles]
+        corners: ndarray = CoordsHelp.get_all_pos_batch(array([state.position for state in states]),
+                                                        array([state.orientation for state in states]),
+                                                        DrawConfig.car_length, DrawConfig.car_width)
+        colors: List[str] = [DrawConfig.colors[state.time_step % len(DrawConfig.colors)] for state in states]
+        collection: PolyCollection = PolyCollection(corners, closed=True, facecolors='none', edgecolors=colors)
+        gca().add_collection(collection)
+        gca().autoscale_view()
+        return collection
+
+    @staticmethod
+    def draw_geometries(geometries: List[BaseGeometry], color: str = 'orange') -> Optional[LineCollection]:
+        """
+        Draws the boundaries of all the given shapely geometries as a single collection.
+        :param geometries: The polygons, multi polygons, line strings or multi line strings to draw.
+        :param color: The color of all boundaries.
+        :return The collection drawn on the current plot or None if there is no boundary to draw.
+        """
+        lines: List[ndarray] = []
+
+        def collect(geometry: BaseGeometry) -> None:
+            if geometry.is_empty:
+                return
+            if hasattr(geometry, 'geoms'):
+                for part in geometry.geoms:
+                    collect(part)
+            elif isinstance(geometry, Polygon):
+                collect(geometry.exterior)
+                for interior in geometry.interiors:
+                    collect(interior)
+            elif isinstance(geometry, (LineString, LinearRing)):
+                lines.append(asarray(geometry.coords)[:, :2])
+            else:
+                warning("Drawing the boundary of " + str(type(geometry)) + " is not implemented, yet.")
+
+        for geometry in geometries:
+            collect(geometry)
+        if not lines:
+            return None
+        collection: LineCollection = LineCollection(lines, colors=color)
+        gca().add_collection(collection)
+        gca().autoscale_view()
+        return collection
+
     @staticmethod
     def union_to_polygon(drawables: List[drawable_types]) -> MultiPolygon:
         polygons: List[Polygon] = []
@@ -137,7 +203,7 @@ class DrawHelp:
             elif isinstance(drawable, Polygon):
                 polygons.append(drawable)
             elif isinstance(drawable, MultiPolygon):
-                for polygon in drawable:
+                for polygon in drawable.geoms:
                     polygons.append(polygon)
             else:
                 warning("Union with " + str(type(drawable)) + " not implemented, yet.")
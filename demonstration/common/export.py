@@ -0,0 +1,91 @@
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Optional
+
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.artist import Artist
+from matplotlib.figure import Figure
+
+
+class FrameExporter:
+    """
+    Streams the frames of an animation to a video or to single images. Everything drawn before start() is rendered only
+    once as background. For each frame the background is restored and only the given moving artists are drawn on top of
+    it. Frames are written as soon as they are rendered so the memory required does not depend on the number of frames.
+    Paths ending with ".mp4" are encoded by piping the raw frames to ffmpeg. Any other path is used as pattern for the
+    paths of single PNG images like "frame_{:03d}.png" which are written by a pool of threads.
+    """
+
+    def __init__(self, figure: Figure, output_path: str, fps: float, num_threads: int = 4):
+        self.figure = figure
+        self.output_path = output_path
+        self.fps = fps
+        self.num_threads = num_threads
+        self.num_frames = 0
+        self._background = None
+        self._ffmpeg: Optional[subprocess.Popen] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: List[Future] = []
+
+    def __enter__(self) -> 'FrameExporter':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.finish()
+
+    def start(self) -> None:
+        """
+        Renders the current content of the figure as background of all frames and prepares the output.
+        """
+        canvas = self.figure.canvas
+        for axes in self.figure.axes:
+            axes.set_autoscale_on(False)  # Moving artists must not change the limits of the background
+        canvas.draw()
+        self._background = canvas.copy_from_bbox(self.figure.bbox)
+        width, height = canvas.get_width_height()
+        if self.output_path.endswith(".mp4"):
+            self._ffmpeg = subprocess.Popen(
+                ["ffmpeg", "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgba",
+                 "-s", str(width) + "x" + str(height), "-r", str(self.fps), "-i", "-",
+                 "-pix_fmt", "yuv420p", "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", self.output_path],
+                stdin=subprocess.PIPE)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.num_threads)
+
+    def write_frame(self, moving_artists: List[Artist]) -> None:
+        """
+        Renders the given artists on top of the background and writes the resulting frame.
+        :param moving_artists: The artists which are only part of the current frame.
+        """
+        canvas = self.figure.canvas
+        canvas.restore_region(self._background)
+        for artist in moving_artists:
+            artist.set_animated(True)  # Prevents the artist from becoming part of any later full redraw
+            self.figure.draw_artist(artist)
+        frame: np.ndarray = np.asarray(canvas.buffer_rgba())
+        if self._ffmpeg is not None:
+            self._ffmpeg.stdin.write(frame.tobytes())
+        else:
+            # Limit the number of frames waiting to be written
+            while len(self._pending) >= 2 * self.num_threads:
+                self._pending.pop(0).result()
+            self._pending.append(self._executor.submit(plt.imsave, self.output_path.format(self.num_frames),
+                                                       frame.copy()))
+        self.num_frames += 1
+
+    def finish(self) -> None:
+        """
+        Waits for all frames to be written and closes the output.
+        """
+        if self._ffmpeg is not None:
+            self._ffmpeg.stdin.close()
+            self._ffmpeg.wait()
+            self._ffmpeg = None
+        if self._executor is not None:
+            for future in self._pending:
+                future.result()
+            self._pending = []
+            self._executor.shutdown()
+            self._executor = None
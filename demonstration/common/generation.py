@@ -1,21 +1,28 @@
-import time
-from copy import deepcopy
-from multiprocessing import Process, Value, Manager
+from hashlib import sha1
+from itertools import compress
+from logging import warning
+from multiprocessing import Process
+from time import perf_counter
 from typing import Tuple, Union, Optional, Dict, List
 
-import psutil
 from commonroad.geometry.shape import Shape, Rectangle
 from commonroad.planning.planning_problem import PlanningProblem
 from commonroad.prediction.prediction import TrajectoryPrediction
 from commonroad.scenario.scenario import Scenario
-from commonroad.scenario.trajectory import Trajectory
-from numpy import linspace
+from commonroad.scenario.trajectory import Trajectory, State
+from numpy import linspace, array, repeat, column_stack, newaxis, flatnonzero
 from numpy.core.multiarray import ndarray
 from numpy.core.umath import pi, cos, sin
 from numpy.random.mtrand import uniform
 
-from common import is_valid, VehicleInfo, MyState
-from common.StatesQueue import StatesQueue
+from common import is_valid, are_valid, VehicleInfo, MyState, are_on_road, are_colliding
+from common.StatesIndex import StatesIndex
+from common.StatesStore import StatesStore
+from common.cache import GenerationCache
+from common.coords import CoordsHelp
+from common.grid import GridConfig, OccupancyGrid
+from common.index import RoadIndex, ObstacleIndex, scenario_fingerprint
+from common.stats import GenerationStats
 from common.draw import DrawHelp, DrawConfig
 
 
@@ -23,88 +30,275 @@ class GenerationConfig:
     max_yaw: float = pi / 16  # 11.25°
     yaw_steps: int = 32
     num_threads: int = 8
+    max_states: int = 1 << 18  # The maximum number of states a single generation can store
     position_threshold = 0.5
     angle_threshold = max_yaw * 0.5  # NOTE Needs to be way smaller than max_yaw otherwise the car tends to the right.
+    cache: Optional[GenerationCache] = None  # If set generate_records(...) reuses the results of previous generations
 
 
 class GenerationHelp:
+    @staticmethod
+    def predict_next_position(x: Union[float, ndarray], y: Union[float, ndarray], orientation: Union[float, ndarray],
+                              velocity: Union[float, ndarray], dt: float) \
+            -> Tuple[Union[float, ndarray], Union[float, ndarray]]:
+        """
+        Calculates the position a car reaches after driving for dt with the given orientation and velocity. All the
+        arguments may also be arrays to calculate the next positions of many cars at once.
+        :return: The x and y coordinate of the next position.
+        """
+        distance: Union[float, ndarray] = velocity * dt
+        return x + cos(orientation) * distance, y + sin(orientation) * distance
+
     @staticmethod
     def predict_next_state(scenario: Scenario, current: MyState) -> MyState:
-        next: MyState = deepcopy(current)
-        delta_x: float = cos(next.state.orientation) * next.state.velocity * scenario.dt
-        delta_y: float = sin(next.state.orientation) * next.state.velocity * scenario.dt
-        next.state.position[0] += delta_x
-        next.state.position[1] += delta_y
+        next: MyState = current.copy()
+        next.state.position[0], next.state.position[1] = GenerationHelp.predict_next_position(
+            next.state.position[0], next.state.position[1], next.state.orientation, next.state.velocity, scenario.dt)
         return next
 
     @staticmethod
-    def generate_states(scenario: Scenario, ego_vehicle: MyState, time_steps: int) \
-            -> Tuple[Dict[int, List[VehicleInfo]], int]:
+    def generation_key(scenario: Scenario, ego_vehicle: MyState, time_steps: int) -> str:
         """
-        Generates all positions the ego vehicle can have within the next steps in the given scenario and considering the
-        given preplanning problem.
+        Calculates a key identifying the result of a generation. It covers the scenario, the initial state, the number
+        of time steps and all settings influencing the generated states.
+        :return: The key as hex string.
+        """
+        state = ego_vehicle.state
+        return sha1(repr((scenario_fingerprint(scenario),
+                          float(state.position[0]), float(state.position[1]), float(state.orientation),
+                          float(state.velocity), int(state.time_step), time_steps,
+                          GenerationConfig.max_yaw, GenerationConfig.yaw_steps, GenerationConfig.max_states,
+                          GenerationConfig.position_threshold, GenerationConfig.angle_threshold,
+                          DrawConfig.car_length, DrawConfig.car_width,
+                          GridConfig.enabled, GridConfig.resolution if GridConfig.enabled else None)).encode()) \
+            .hexdigest()
+
+    @staticmethod
+    def _lap(stats: GenerationStats, worker: int, stage_start: float, timer: str, **counters: int) -> float:
+        """
+        Adds the time since stage_start to the given timer and the given counters to the stats of the given worker.
+        :return: The current time which is the start of the next stage.
+        """
+        now: float = perf_counter()
+        stats.add(worker, **{timer: now - stage_start}, **counters)
+        return now
+
+    @staticmethod
+    def generate_records(scenario: Scenario, ego_vehicle: MyState, time_steps: int,
+                         stats: Optional[GenerationStats] = None) -> ndarray:
+        """
+        Generates all positions the ego vehicle can have within the next steps in the given scenario. In contrast to
+        generate_states(...) the states are returned as compact records. (See StatesStore)
         :param scenario: The scenario the ego vehicle is driving in.
         :param ego_vehicle: The initial state of the ego vehicle.
         :param time_steps: The number of steps to simulate.
-        :return: A tuple containing a dictionary mapping a time step to all generated valid states and their drawable
-        representation of that time step and the number of total states processed.
+        :param stats: If given the counters and timers of all stages of the generation are collected there. Collecting
+        them slows down the generation slightly.
+        :return: The records of all generated valid states. The first record represents the initial state. If
+        GenerationConfig.cache is set the records are read-only.
         """
-        num_states_processed: Value = Value('i', 0)
-        manager: Manager = Manager()
-        valid_converted: Dict[int, List[VehicleInfo]] = manager.dict()
-        for step in range(1, time_steps + 1):
-            valid_converted[step] = manager.list()
-        current_states: StatesQueue = StatesQueue(GenerationConfig.position_threshold, GenerationConfig.angle_threshold)
-        current_states.put(ego_vehicle)
-
-        def generate_next_states() -> None:
+        start_time: float = perf_counter()
+        cache_key: Optional[str] = None
+        if GenerationConfig.cache is not None:
+            cache_key = GenerationHelp.generation_key(scenario, ego_vehicle, time_steps)
+            cached: Optional[ndarray] = GenerationConfig.cache.get(cache_key)
+            if cached is not None:
+                if stats is not None:
+                    stats.cache_hit = True
+                    stats.finish(cached)
+                    stats.total_time = perf_counter() - start_time
+                return cached
+
+        store: StatesStore = StatesStore(
+            GenerationConfig.max_states, GenerationConfig.position_threshold, GenerationConfig.angle_threshold)
+        store.append(ego_vehicle.state.time_step, ego_vehicle.state.position[0], ego_vehicle.state.position[1],
+                     ego_vehicle.state.orientation, ego_vehicle.state.velocity, -1, skip_duplicate=False)
+        # Build the indices once so the workers inherit them
+        RoadIndex.of(scenario)
+        ObstacleIndex.of(scenario).precompute(range(ego_vehicle.state.time_step, time_steps + 1))
+        if GridConfig.enabled:
+            OccupancyGrid.of(scenario).precompute(range(ego_vehicle.state.time_step, time_steps + 1))
+        if stats is not None:
+            stats.start(GenerationConfig.num_threads)
+            stats.setup_time = perf_counter() - start_time
+
+        yaw_steps: Union[ndarray, Tuple[ndarray, Optional[float]]] \
+            = linspace(-GenerationConfig.max_yaw, GenerationConfig.max_yaw,
+                       num=GenerationConfig.yaw_steps, endpoint=True)
+
+        def expand_record(worker: int, record_id: int) -> None:
+            time_step, x, y, orientation, velocity, _ = store.records[record_id].item()
+            if time_step < time_steps:
+                stage_start: float = perf_counter() if stats is not None else 0
+                next_orientation: ndarray = orientation + yaw_steps
+                next_x, next_y = GenerationHelp.predict_next_position(x, y, next_orientation, velocity, scenario.dt)
+                if stats is not None:
+                    stage_start = GenerationHelp._lap(stats, worker, stage_start, 'propagation_time',
+                                                       propagated=len(yaw_steps))
+
+                candidates: List[int] = [i for i in range(len(yaw_steps))
+                                         if not store.contains(next_x[i], next_y[i], next_orientation[i])]
+                if stats is not None:
+                    stage_start = GenerationHelp._lap(stats, worker, stage_start, 'dedup_time',
+                                                       duplicate_hits=len(yaw_steps) - len(candidates),
+                                                       duplicate_misses=len(candidates))
+
+                # NOTE The candidates are checked against the occupancies of the time step they are generated from
+                footprints: ndarray = CoordsHelp.get_all_pos_batch(
+                    column_stack((next_x[candidates], next_y[candidates])), next_orientation[candidates],
+                    DrawConfig.car_length, DrawConfig.car_width)
+                on_road: ndarray = are_on_road(footprints, scenario)
+                if stats is not None:
+                    stage_start = GenerationHelp._lap(stats, worker, stage_start, 'road_time',
+                                                       road_rejects=int((~on_road).sum()))
+                colliding: ndarray = are_colliding(footprints, time_step, scenario)
+                valid: ndarray = on_road & ~colliding
+                if stats is not None:
+                    stage_start = GenerationHelp._lap(stats, worker, stage_start, 'obstacle_time',
+                                                       obstacle_rejects=int((on_road & colliding).sum()))
+
+                accepted: int = 0
+                for i in compress(candidates, valid):
+                    if store.append(time_step + 1, next_x[i], next_y[i], next_orientation[i], velocity, record_id) > -1:
+                        accepted += 1
+                if stats is not None:
+                    GenerationHelp._lap(stats, worker, stage_start, 'append_time', accepted=accepted,
+                                        append_duplicates=int(valid.sum()) - accepted)
+
+        def generate_next_states(worker: int) -> None:
             while True:
-                state: MyState = current_states.get()
-                if state.state.time_step < time_steps:
-                    yaw_steps: Union[ndarray, Tuple[ndarray, Optional[float]]] \
-                        = linspace(-GenerationConfig.max_yaw, GenerationConfig.max_yaw,
-                                   num=GenerationConfig.yaw_steps, endpoint=True)
-                    for yaw in yaw_steps:
-                        transformed: MyState = deepcopy(state)
-                        transformed.state.orientation += yaw
-                        transformed = GenerationHelp.predict_next_state(scenario, transformed)
-                        if transformed not in current_states:
-                            vehicle: VehicleInfo = VehicleInfo(transformed, None)
-                            if is_valid(vehicle, scenario):
-                                transformed.state.time_step += 1
-                                valid_converted[transformed.state.time_step].append(vehicle)
-                                current_states.put(transformed)
-                current_states.task_done()
-                num_states_processed.value += 1
+                if stats is None:
+                    record_id: Optional[int] = store.claim()
+                else:
+                    wait_start: float = perf_counter()
+                    record_id = store.claim()
+                    now: float = perf_counter()
+                    stats.add(worker, queue_wait_time=now - wait_start)
+                    if record_id is None:
+                        stats.set(worker, 'completion_detected', now)
+                    else:
+                        stats.add(worker, claims=1)
+                if record_id is None:
+                    break
+                try:
+                    expand_record(worker, record_id)
+                finally:
+                    # NOTE Otherwise the other workers wait for this record forever if expanding it failed
+                    store.done(record_id)
+                if stats is not None:
+                    stats.set(worker, 'last_done', perf_counter())
 
         # Start workers
-        workers: List[psutil.Process] = []
+        workers: List[Process] = []
         for i in range(GenerationConfig.num_threads):
-            worker: Process = Process(target=generate_next_states, args=(), daemon=True)
+            worker: Process = Process(target=generate_next_states, args=(i,), daemon=True)
             worker.start()
-            workers.append(psutil.Process(worker.pid))
+            workers.append(worker)
 
         # Wait for workers to finish
-        def wait():
-            do_all_sleep = False
-            while not do_all_sleep:
-                time.sleep(1)
-                do_all_sleep = all(map(lambda w: w.status() == "sleeping", workers))
-                if do_all_sleep:
-                    print("Generation workers fell asleep.")
-                    time.sleep(3)
-                    # Still sleeping?
-                    do_all_sleep = all(map(lambda w: w.status() == "sleeping", workers))
-                    if do_all_sleep:
-                        print("Generation workers still sleeping --> Assume generation finished.")
-
-        waiter: Process = Process(target=wait, args=(), daemon=True)
-        waiter.start()
-        waiter.join()
         for worker in workers:
-            worker.terminate()
+            worker.join()
+        failed: List[Process] = [worker for worker in workers if worker.exitcode != 0]
+        if failed:
+            raise Exception(str(len(failed)) + " of " + str(len(workers)) + " generation workers failed (exit codes "
+                            + ", ".join(str(worker.exitcode) for worker in failed) + ").")
+
+        records: ndarray = store.records[:store.size].copy()
+        if store.overflow:
+            warning("The generation exceeded GenerationConfig.max_states. Not all states were generated.")
+        elif cache_key is not None:
+            GenerationConfig.cache.put(cache_key, records)
+        if stats is not None:
+            stats.finish(records)
+            stats.total_time = perf_counter() - start_time
+        return records
+
+    @staticmethod
+    def generate_states(scenario: Scenario, ego_vehicle: MyState, time_steps: int,
+                        stats: Optional[GenerationStats] = None) -> Tuple[Dict[int, List[VehicleInfo]], int]:
+        """
+        Generates all positions the ego vehicle can have within the next steps in the given scenario and considering the
+        given preplanning problem.
+        :param scenario: The scenario the ego vehicle is driving in.
+        :param ego_vehicle: The initial state of the ego vehicle.
+        :param time_steps: The number of steps to simulate.
+        :param stats: If given the counters and timers of all stages of the generation are collected there. (See
+        GenerationStats)
+        :return: A tuple containing a dictionary mapping a time step to all generated valid states and their drawable
+        representation of that time step and the number of total states processed.
+        """
+        records: ndarray = GenerationHelp.generate_records(scenario, ego_vehicle, time_steps, stats)
+        return StatesStore.to_vehicle_infos(records, time_steps), len(records)
+
+    @staticmethod
+    def generate_states_vectorized(scenario: Scenario, ego_vehicle: MyState, time_steps: int) \
+            -> Tuple[Dict[int, List[VehicleInfo]], int]:
+        """
+        Generates all positions the ego vehicle can have within the next steps like generate_states(...) does. Instead
+        of expanding state by state all states of a time step are expanded at once. Their positions, orientations and
+        velocities are stored as arrays which are combined with all yaw steps in a single step. The resulting candidates
+        are validated as a batch. Like generate_states(...) with a single thread the valid candidates are accepted in
+        order unless they are close to any state accepted before. (See StatesIndex)
+        :param scenario: The scenario the ego vehicle is driving in.
+        :param ego_vehicle: The initial state of the ego vehicle.
+        :param time_steps: The number of steps to simulate.
+        :return: A tuple containing a dictionary mapping a time step to all generated valid states and their drawable
+        representation of that time step and the number of total states processed.
+        """
+        yaw_steps: ndarray = linspace(-GenerationConfig.max_yaw, GenerationConfig.max_yaw,
+                                      num=GenerationConfig.yaw_steps, endpoint=True)
+        x: ndarray = array([ego_vehicle.state.position[0]], dtype=float)
+        y: ndarray = array([ego_vehicle.state.position[1]], dtype=float)
+        orientation: ndarray = array([ego_vehicle.state.orientation], dtype=float)
+        velocity: ndarray = array([ego_vehicle.state.velocity], dtype=float)
+        index: StatesIndex = StatesIndex(GenerationConfig.position_threshold, GenerationConfig.angle_threshold)
+        index.add(x[0], y[0], orientation[0])
+        # NOTE Like in StatesStore.to_vehicle_infos(...) the keys are the time steps of the states
+        valid_converted: Dict[int, List[VehicleInfo]] = {step: [] for step in range(1, time_steps + 1)}
+        num_states_processed: int = 1
+        time_step: int = ego_vehicle.state.time_step
+        while time_step < time_steps and len(x) > 0:
+            # Combine all states of the last time step with all yaw steps (N x yaw_steps candidates)
+            candidate_orientation: ndarray = (orientation[:, newaxis] + yaw_steps[newaxis, :]).ravel()
+            candidate_velocity: ndarray = repeat(velocity, len(yaw_steps))
+            candidate_x, candidate_y = GenerationHelp.predict_next_position(
+                repeat(x, len(yaw_steps)), repeat(y, len(yaw_steps)), candidate_orientation, candidate_velocity,
+                scenario.dt)
+
+            # Candidates close to states of previous time steps are dropped whether they are valid or not
+            unknown: ndarray = array([not index.contains(cx, cy, co) for cx, cy, co
+                                      in zip(candidate_x, candidate_y, candidate_orientation)], dtype=bool)
+            candidate_x = candidate_x[unknown]
+            candidate_y = candidate_y[unknown]
+            candidate_orientation = candidate_orientation[unknown]
+            candidate_velocity = candidate_velocity[unknown]
+
+            # NOTE Like in generate_states(...) candidates are checked against the occupancies of the time step they
+            # are generated from.
+            valid: ndarray = are_valid(
+                CoordsHelp.get_all_pos_batch(column_stack((candidate_x, candidate_y)), candidate_orientation,
+                                             DrawConfig.car_length, DrawConfig.car_width),
+                time_step, scenario)
+
+            # Keep only the first valid candidate of all the candidates which are close to each other
+            accepted: List[int] = []
+            for i in flatnonzero(valid):
+                if not index.contains(candidate_x[i], candidate_y[i], candidate_orientation[i]):
+                    index.add(candidate_x[i], candidate_y[i], candidate_orientation[i])
+                    accepted.append(i)
+            x = candidate_x[accepted]
+            y = candidate_y[accepted]
+            orientation = candidate_orientation[accepted]
+            velocity = candidate_velocity[accepted]
+            num_states_processed += len(x)
+            time_step += 1
 
-        return valid_converted, num_states_processed.value
+            layer: List[VehicleInfo] = valid_converted.setdefault(time_step, [])
+            for i in range(len(x)):
+                state: State = State(position=array([x[i], y[i]]), orientation=orientation[i], velocity=velocity[i],
+                                     time_step=time_step)
+                layer.append(VehicleInfo(MyState(state), None))
+        return valid_converted, num_states_processed
 
     @staticmethod
     def generate_trajectory(scenario: Scenario, planning_problem: PlanningProblem, time_steps: int,
@@ -125,7 +319,7 @@ class GenerationHelp:
         vehicles: List[VehicleInfo] = [VehicleInfo(MyState(planning_problem.initial_state), None,
                                                    DrawHelp.convert_to_drawable(planning_problem.initial_state))]
         for i in range(1, time_steps):
-            last_state_copy: MyState = deepcopy(states[i - 1])
+            last_state_copy: MyState = states[i - 1].copy()
             found_valid_next: bool = False
             tries: int = 0
             while not found_valid_next and tries < max_tries:
@@ -137,7 +331,7 @@ class GenerationHelp:
                     found_valid_next = True
                 else:
                     tries += 1
-                    last_state_copy.orientation \
+                    last_state_copy.state.orientation \
                         = states[i - 1].state.orientation + uniform(-GenerationConfig.max_yaw, GenerationConfig.max_yaw)
             if not found_valid_next:
                 break
@@ -0,0 +1,160 @@
+import os
+from hashlib import sha1
+from logging import warning
+from tempfile import mkstemp
+from typing import Dict, Optional, Iterable, Tuple, List
+from weakref import WeakKeyDictionary
+
+import numpy as np
+from commonroad.scenario.scenario import Scenario
+from shapely.geometry.base import BaseGeometry
+from shapely.ops import unary_union
+
+from common.index import RoadIndex, ObstacleIndex, scenario_fingerprint, contains_xy
+
+
+class GridConfig:
+    enabled: bool = False  # If True is_valid(...) and are_valid(...) use an OccupancyGrid instead of exact geometries
+    resolution: float = 0.25  # The edge length of a cell [m]
+    margin: float = 5  # The distance the grid exceeds the road on each side [m]
+    cache_dir: Optional[str] = None  # If set rasterized grids are stored there and reused by later runs
+
+
+class OccupancyGrid:
+    """
+    Represents the road and the obstacles of a scenario as bitmaps. A cell is occupied if its center is occupied. Hence
+    a position is classified like the center of its cell which is at most error_bound away from it.
+    """
+    _grids: WeakKeyDictionary = WeakKeyDictionary()
+
+    def __init__(self, scenario: Scenario, resolution: float, cache_dir: Optional[str] = None):
+        self.scenario = scenario
+        self.resolution = resolution
+        self.cache_dir = cache_dir
+        self.margin: float = GridConfig.margin
+        self._obstacles: Dict[int, np.ndarray] = {}
+        from common.compiled import CompiledScenario
+        min_x, min_y, max_x, max_y = scenario.bounds if isinstance(scenario, CompiledScenario) \
+            else RoadIndex.of(scenario).road.bounds
+        self.origin: np.ndarray = np.array([min_x - self.margin, min_y - self.margin])
+        self.shape: Tuple[int, int] = (int(np.ceil((max_x - min_x + 2 * self.margin) / resolution)),
+                                       int(np.ceil((max_y - min_y + 2 * self.margin) / resolution)))
+        self._key: Optional[str] = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            # NOTE The origin and the shape depend on the margin. Stored grids of other margins do not fit.
+            self._key = sha1(repr((scenario_fingerprint(scenario), resolution, tuple(self.origin), self.shape))
+                             .encode()).hexdigest()
+        self.road: np.ndarray = self._load_or_rasterize("road", lambda: RoadIndex.of(scenario).road)
+
+    @staticmethod
+    def of(scenario: Scenario) -> 'OccupancyGrid':
+        """
+        Returns the grid of the given scenario using the settings of GridConfig. The grid is only created on the first
+        call or if the settings changed.
+        """
+        from common.compiled import CompiledScenario
+        compiled: bool = isinstance(scenario, CompiledScenario)
+        grid: Optional[OccupancyGrid] = scenario.occupancy_grid if compiled else OccupancyGrid._grids.get(scenario)
+        if grid is None or grid.resolution != GridConfig.resolution or grid.margin != GridConfig.margin \
+                or grid.cache_dir != GridConfig.cache_dir:
+            grid = OccupancyGrid(scenario, GridConfig.resolution, GridConfig.cache_dir)
+            if compiled:
+                scenario.occupancy_grid = grid
+            else:
+                OccupancyGrid._grids[scenario] = grid
+        return grid
+
+    @property
+    def error_bound(self) -> float:
+        """
+        :return: The maximum distance between a position and the cell center it is classified by. Only positions which
+        are at least this distance away from the border of the road or any obstacle are guaranteed to be classified like
+        the exact geometries would classify them.
+        """
+        return self.resolution * np.sqrt(2) / 2
+
+    def _rasterize(self, geometry: BaseGeometry) -> np.ndarray:
+        grid: np.ndarray = np.zeros(self.shape, dtype=bool)
+        if geometry.is_empty:
+            return grid
+        # Only test the cells within the bounding box of the geometry
+        min_x, min_y, max_x, max_y = geometry.bounds
+        (first_x, first_y), (last_x, last_y) = self._cells(np.array([[min_x, min_y], [max_x, max_y]]))
+        first_x, first_y = max(first_x, 0), max(first_y, 0)
+        last_x, last_y = min(last_x, self.shape[0] - 1), min(last_y, self.shape[1] - 1)
+        if first_x > last_x or first_y > last_y:
+            return grid
+        centers_x, centers_y = np.meshgrid(
+            self.origin[0] + (np.arange(first_x, last_x + 1) + 0.5) * self.resolution,
+            self.origin[1] + (np.arange(first_y, last_y + 1) + 0.5) * self.resolution, indexing='ij')
+        grid[first_x:last_x + 1, first_y:last_y + 1] \
+            = np.asarray(contains_xy(geometry, centers_x.ravel(), centers_y.ravel()), dtype=bool) \
+            .reshape(centers_x.shape)
+        return grid
+
+    def _load_or_rasterize(self, name: str, geometry) -> np.ndarray:
+        path: Optional[str] = os.path.join(self.cache_dir, self._key + "_" + name + ".npy") if self._key else None
+        if path and os.path.exists(path):
+            try:
+                stored: np.ndarray = np.load(path, mmap_mode='r')
+                if stored.shape == self.shape and stored.dtype == bool:
+                    return stored
+                warning("The stored grid " + path + " does not fit the grid. It is rasterized again.")
+            except (OSError, ValueError) as ex:
+                warning("Could not load the stored grid " + path + ": " + str(ex))
+        grid: np.ndarray = self._rasterize(geometry())
+        if path:
+            # Write to a temporary file first so other processes never load a partially written grid
+            handle, temporary_path = mkstemp(dir=self.cache_dir, suffix=".npy.tmp")
+            try:
+                with os.fdopen(handle, "wb") as file:
+                    np.save(file, grid)
+                os.replace(temporary_path, path)
+            except OSError as ex:
+                warning("Could not store the grid " + path + ": " + str(ex))
+                if os.path.exists(temporary_path):
+                    os.remove(temporary_path)
+        return grid
+
+    def _cells(self, points: np.ndarray) -> np.ndarray:
+        return np.floor((points - self.origin) / self.resolution).astype(int)
+
+    def precompute(self, time_steps: Iterable[int]) -> None:
+        """
+        Rasterizes the obstacles of the given time steps in advance. (E.g. before forking worker processes)
+        """
+        for time_step in time_steps:
+            self.obstacles_at(time_step)
+
+    def obstacles_at(self, time_step: int) -> np.ndarray:
+        """
+        Returns the bitmap of all cells occupied by any obstacle at the given time step.
+        """
+        if time_step not in self._obstacles:
+            shapes: List[BaseGeometry] = ObstacleIndex.of(self.scenario).shapes_at(time_step)
+            self._obstacles[time_step] = self._load_or_rasterize("obstacles_" + str(time_step),
+                                                                 lambda: unary_union(shapes))
+        return self._obstacles[time_step]
+
+    def _lookup(self, grid: np.ndarray, points: np.ndarray) -> np.ndarray:
+        cells: np.ndarray = self._cells(points.reshape(-1, 2))
+        inside: np.ndarray = (cells[:, 0] >= 0) & (cells[:, 0] < self.shape[0]) \
+            & (cells[:, 1] >= 0) & (cells[:, 1] < self.shape[1])
+        values: np.ndarray = np.zeros(len(cells), dtype=bool)
+        values[inside] = grid[cells[inside, 0], cells[inside, 1]]
+        return values.reshape(points.shape[:-1])
+
+    def contains(self, positions: np.ndarray) -> np.ndarray:
+        """
+        Checks which of the given vehicles are completely on the road. (See RoadIndex.contains(...))
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 4, 2)
+        return self._lookup(self.road, positions).all(axis=1)
+
+    def intersects(self, positions: np.ndarray, time_step: int) -> np.ndarray:
+        """
+        Checks which of the given vehicles have any corner within an obstacle. (See ObstacleIndex.intersects(...))
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 4, 2)
+        return self._lookup(self.obstacles_at(time_step), positions).any(axis=1)
@@ -0,0 +1,213 @@
+from hashlib import sha1
+from typing import List, Dict, Optional, Iterable
+from weakref import WeakKeyDictionary
+
+import numpy as np
+from commonroad.geometry.shape import Shape, Circle, ShapeGroup
+from commonroad.prediction.prediction import Occupancy
+from commonroad.scenario.lanelet import LaneletNetwork
+from commonroad.scenario.scenario import Scenario
+from shapely.geometry import Polygon, Point
+from shapely.geometry.base import BaseGeometry
+from shapely.ops import unary_union
+
+try:
+    from shapely import contains_xy, prepare
+except ImportError:  # shapely < 2.0 prepares the geometry within each call of contains(...)
+    from shapely.vectorized import contains as contains_xy
+    prepare = None
+
+
+class RoadIndex:
+    """
+    Represents the area covered by all lanelets of a lanelet network as a single geometry. It is built once per lanelet
+    network and answers whether positions are on the road for many positions at once.
+    """
+    _indices: WeakKeyDictionary = WeakKeyDictionary()
+
+    def __init__(self, lanelet_network: LaneletNetwork):
+        polygons: List[Polygon] = []
+        for lanelet in lanelet_network.lanelets:
+            polygon: Polygon = lanelet.convert_to_polygon().shapely_object
+            polygons.append(polygon if polygon.is_valid else polygon.buffer(0))
+        self.road: BaseGeometry = unary_union(polygons)
+        if prepare:
+            prepare(self.road)
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        if prepare:
+            prepare(self.road)  # Prepared geometries are not pickled
+
+    @staticmethod
+    def of(scenario: Scenario) -> 'RoadIndex':
+        """
+        Returns the index of the lanelet network of the given scenario. The index is only built on the first call.
+        """
+        from common.compiled import CompiledScenario
+        if isinstance(scenario, CompiledScenario):
+            return scenario.road_index
+        lanelet_network: LaneletNetwork = scenario.lanelet_network
+        if lanelet_network not in RoadIndex._indices:
+            RoadIndex._indices[lanelet_network] = RoadIndex(lanelet_network)
+        return RoadIndex._indices[lanelet_network]
+
+    def contains_points(self, points: np.ndarray) -> np.ndarray:
+        """
+        Checks which of the given points lie on the road.
+        :param points: The points to check as array of shape (..., 2).
+        :return: An array of the shape of points without its last dimension which is True for all points on the road.
+        """
+        points = np.asarray(points, dtype=float)
+        flat_points: np.ndarray = points.reshape(-1, 2)
+        contained: np.ndarray = np.asarray(contains_xy(self.road, flat_points[:, 0], flat_points[:, 1]), dtype=bool)
+        return contained.reshape(points.shape[:-1])
+
+    def contains(self, positions: np.ndarray) -> np.ndarray:
+        """
+        Checks which of the given vehicles are completely on the road.
+        :param positions: The corner positions of all vehicles as array of shape (N, 4, 2).
+        :return: An array of shape (N,) which is True for all vehicles whose corners all lie on the road.
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 4, 2)
+        return self.contains_points(positions).all(axis=1)
+
+
+_fingerprints: WeakKeyDictionary = WeakKeyDictionary()
+
+
+def scenario_fingerprint(scenario: Scenario) -> str:
+    """
+    Calculates a hash of everything of the given scenario which influences the validity of positions. These are the
+    lanelets, the shapes of all obstacles and the trajectories of dynamic obstacles. The hash is only calculated on the
+    first call for a scenario like the indices of RoadIndex.of(...) and ObstacleIndex.of(...) are.
+    :param scenario: The scenario to calculate the fingerprint for.
+    :return: The fingerprint as hex string.
+    """
+    from common.compiled import CompiledScenario
+    if isinstance(scenario, CompiledScenario):
+        return scenario.fingerprint
+    if scenario not in _fingerprints:
+        _fingerprints[scenario] = _calculate_fingerprint(scenario)
+    return _fingerprints[scenario]
+
+
+def _calculate_fingerprint(scenario: Scenario) -> str:
+    fingerprint = sha1()
+    fingerprint.update(repr(scenario.dt).encode())
+    for lanelet in sorted(scenario.lanelet_network.lanelets, key=lambda l: l.lanelet_id):
+        fingerprint.update(repr(lanelet.lanelet_id).encode())
+        fingerprint.update(np.ascontiguousarray(lanelet.left_vertices, dtype=float).tobytes())
+        fingerprint.update(np.ascontiguousarray(lanelet.right_vertices, dtype=float).tobytes())
+    for obstacle in sorted(scenario.obstacles, key=lambda o: o.obstacle_id):
+        fingerprint.update(repr(obstacle.obstacle_id).encode())
+        fingerprint.update(str(obstacle.obstacle_shape).encode())
+        states = [obstacle.initial_state]
+        prediction = getattr(obstacle, 'prediction', None)
+        if prediction is not None and hasattr(prediction, 'trajectory'):
+            states.extend(prediction.trajectory.state_list)
+        for state in states:
+            fingerprint.update(np.array([getattr(state, 'time_step', 0), state.position[0], state.position[1],
+                                         state.orientation], dtype=float).tobytes())
+    return fingerprint.hexdigest()
+
+
+def to_shapely(shape: Shape) -> BaseGeometry:
+    """
+    Converts the given commonroad shape to a shapely geometry.
+    """
+    if isinstance(shape, Circle):
+        return Point(shape.center).buffer(shape.radius)
+    elif isinstance(shape, ShapeGroup):
+        return unary_union([to_shapely(s) for s in shape.shapes])
+    else:
+        return shape.shapely_object
+
+
+class ObstacleIndex:
+    """
+    Caches the occupancies of all static and dynamic obstacles of a scenario per time step. For each time step the
+    occupied shapes are stored together with their bounding boxes so only obstacles near a vehicle have to be checked
+    against its exact shape.
+    """
+    _indices: WeakKeyDictionary = WeakKeyDictionary()
+
+    def __init__(self, scenario: Scenario):
+        self.scenario = scenario
+        self._shapes: Dict[int, List[BaseGeometry]] = {}
+        self._bounds: Dict[int, np.ndarray] = {}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        if prepare:
+            for shapes in self._shapes.values():
+                for shape in shapes:
+                    prepare(shape)  # Prepared geometries are not pickled
+
+    @staticmethod
+    def of(scenario: Scenario) -> 'ObstacleIndex':
+        """
+        Returns the obstacle index of the given scenario. The index is only created on the first call.
+        """
+        from common.compiled import CompiledScenario
+        if isinstance(scenario, CompiledScenario):
+            return scenario.obstacle_index
+        if scenario not in ObstacleIndex._indices:
+            ObstacleIndex._indices[scenario] = ObstacleIndex(scenario)
+        return ObstacleIndex._indices[scenario]
+
+    def precompute(self, time_steps: Iterable[int]) -> None:
+        """
+        Computes the occupancies of the given time steps in advance. (E.g. before forking worker processes)
+        """
+        for time_step in time_steps:
+            self.shapes_at(time_step)
+
+    def shapes_at(self, time_step: int) -> List[BaseGeometry]:
+        """
+        Returns the shapes of all obstacles which are present at the given time step.
+        """
+        if time_step not in self._shapes:
+            shapes: List[BaseGeometry] = []
+            for obstacle in self.scenario.obstacles:
+                occupancy: Optional[Occupancy] = obstacle.occupancy_at_time(time_step)
+                if occupancy is not None:
+                    shapes.append(to_shapely(occupancy.shape))
+            self.set_shapes(time_step, shapes)
+        return self._shapes[time_step]
+
+    def set_shapes(self, time_step: int, shapes: List[BaseGeometry]) -> None:
+        """
+        Stores the given shapes as the shapes of all obstacles present at the given time step. (E.g. shapes which were
+        derived from a CompiledScenario)
+        """
+        if prepare:
+            for shape in shapes:
+                prepare(shape)
+        self._shapes[time_step] = shapes
+        self._bounds[time_step] = np.array([shape.bounds for shape in shapes], dtype=float).reshape(-1, 4)
+
+    def intersects(self, positions: np.ndarray, time_step: int) -> np.ndarray:
+        """
+        Checks which of the given vehicles have any corner within an obstacle at the given time step.
+        :param positions: The corner positions of all vehicles as array of shape (N, 4, 2).
+        :param time_step: The time step whose occupancies have to be considered.
+        :return: An array of shape (N,) which is True for all vehicles having a corner within any obstacle.
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 4, 2)
+        shapes: List[BaseGeometry] = self.shapes_at(time_step)
+        intersects: np.ndarray = np.zeros(len(positions), dtype=bool)
+        if not shapes or len(positions) == 0:
+            return intersects
+        min_corner: np.ndarray = positions.min(axis=1)
+        max_corner: np.ndarray = positions.max(axis=1)
+        for shape, (min_x, min_y, max_x, max_y) in zip(shapes, self._bounds[time_step]):
+            # Only vehicles whose bounding box overlaps the bounding box of the obstacle may intersect it
+            nearby: np.ndarray = np.flatnonzero(~intersects
+                                                & (max_corner[:, 0] >= min_x) & (min_corner[:, 0] <= max_x)
+                                                & (max_corner[:, 1] >= min_y) & (min_corner[:, 1] <= max_y))
+            if len(nearby) > 0:
+                points: np.ndarray = positions[nearby].reshape(-1, 2)
+                contained: np.ndarray = np.asarray(contains_xy(shape, points[:, 0], points[:, 1]), dtype=bool)
+                intersects[nearby] = contained.reshape(-1, 4).any(axis=1)
+        return intersects
@@ -51,8 +51,11 @@
 # 2D => invariant to orientation and position => only such as velocity optimized
 # delta a_0^T * W * delta a_0 can be removed in quadratic optimization problem
 # interest in minimizing delta x_0 => optimizing over the shift of delta x_0
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha1
 from queue import Queue
-from typing import Tuple, Dict, List
+from typing import Tuple, Dict, List, Optional
 
 import cvxpy
 import numpy as np
@@ -64,11 +67,80 @@ from dccp import is_dccp  # Make sure there is at least one dccp import. Otherwi
 from numpy import eye, matrix
 from numpy.core.multiarray import ndarray, inner
 from numpy.linalg import norm
-from shapely.geometry import MultiPolygon, Point, Polygon
+from shapely.geometry import Point, Polygon
+from shapely.geometry.base import BaseGeometry
+from shapely.ops import unary_union
 
-from common import drawable_types, VehicleInfo, MyState, flatten_dict_values
-from common.draw import DrawHelp
-from common.generation import GenerationHelp
+from common import VehicleInfo, MyState, flatten_dict_values
+from common.StatesStore import StatesStore
+from common.compiled import CompiledScenario
+from common.generation import GenerationHelp, GenerationConfig
+
+
+# Caches the union of the footprints of a time step and the area profiles of all layers keyed by the hashes of the
+# footprints. Both are bounded by max_cached_area_layers
+_layer_unions: 'OrderedDict[str, BaseGeometry]' = OrderedDict()
+_area_profiles: 'OrderedDict[Tuple[str, ...], ndarray]' = OrderedDict()
+max_cached_area_layers: int = 1024
+
+
+def _cache_lookup(cache: OrderedDict, key):
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+
+def _cache_store(cache: OrderedDict, key, value) -> None:
+    cache[key] = value
+    while len(cache) > max_cached_area_layers:
+        cache.popitem(last=False)
+
+
+def union_footprints(footprints: ndarray) -> BaseGeometry:
+    """
+    Unions the given footprints using a cascaded union.
+    :param footprints: The corner positions of the footprints as array of shape (N, 4, 2).
+    :return: The union of all footprints.
+    """
+    return unary_union([Polygon(footprint) for footprint in footprints])
+
+
+def _calculate_layer_unions(infos: List[VehicleInfo]) -> Tuple[List[int], List[str], List[BaseGeometry]]:
+    if not infos:
+        return [], [], []
+    time_steps: ndarray = np.fromiter((info.state.state.time_step for info in infos), dtype=int, count=len(infos))
+    footprints: ndarray = np.stack([info.footprint for info in infos])
+    order: ndarray = np.argsort(time_steps, kind='stable')
+    layers, first_indices = np.unique(time_steps[order], return_index=True)
+    layer_footprints: List[ndarray] = np.split(footprints[order], first_indices[1:])
+    keys: List[str] = [sha1(np.ascontiguousarray(f).tobytes()).hexdigest() for f in layer_footprints]
+
+    unions: Dict[str, BaseGeometry] = {}
+    missing: Dict[str, ndarray] = {}
+    for key, layer in zip(keys, layer_footprints):
+        union: Optional[BaseGeometry] = _cache_lookup(_layer_unions, key)
+        if union is None:
+            missing[key] = layer
+        else:
+            unions[key] = union
+    if missing:
+        with ThreadPoolExecutor(max_workers=GenerationConfig.num_threads) as executor:
+            for key, union in zip(missing.keys(), executor.map(union_footprints, missing.values())):
+                unions[key] = union
+                _cache_store(_layer_unions, key, union)
+    return list(map(int, layers)), keys, [unions[key] for key in keys]
+
+
+def calculate_layer_unions(infos: List[VehicleInfo]) -> Dict[int, BaseGeometry]:
+    """
+    Calculates the union of the footprints of all states of each time step. The unions of different time steps are
+    calculated in parallel. Unions which were already calculated for the same footprints are taken from a cache.
+    :param infos: All the states at any time step to recognize.
+    :return: A dictionary mapping each time step to the union of the footprints of all its states.
+    """
+    layers, _, unions = _calculate_layer_unions(infos)
+    return dict(zip(layers, unions))
 
 
 def calculate_area_profile(infos: List[VehicleInfo]) -> ndarray:
@@ -77,39 +149,33 @@ def calculate_area_profile(infos: List[VehicleInfo]) -> ndarray:
     :param infos: All the states at any time step to recognize.
     :return: The area profile (In the paper: gamma(S)).
     """
-    partitioned_infos: Dict[int, List[VehicleInfo]] = {}
-    for info in infos:
-        time_step: int = info.state.state.time_step
-        if time_step not in partitioned_infos:
-            partitioned_infos[time_step] = []
-        partitioned_infos[time_step].append(info)
-
-    area_profile: List[float] = []
-    current_area: MultiPolygon = None
-    for key in sorted(partitioned_infos.keys()):
-        to_union: List[drawable_types] = []
-        if current_area:
-            to_union.append(current_area)
-        for info in partitioned_infos[key]:
-            to_union.append(info.drawable)
-        current_area = DrawHelp.union_to_polygon(to_union)
-        area_profile.append(current_area.area)
-    return np.array(area_profile)
+    _, keys, unions = _calculate_layer_unions(infos)  # NOTE The layers are sorted ascending by their time step
+    area_profile: Optional[ndarray] = _cache_lookup(_area_profiles, tuple(keys))
+    if area_profile is None:
+        areas: List[float] = []
+        current_area: Optional[BaseGeometry] = None
+        for union in unions:
+            current_area = union if current_area is None else current_area.union(union)
+            areas.append(current_area.area)
+        area_profile = np.array(areas)
+        _cache_store(_area_profiles, tuple(keys), area_profile)
+    return area_profile.copy()
+
+
+def _records_area_profile(records: ndarray, total_steps: int) -> ndarray:
+    return calculate_area_profile(flatten_dict_values(StatesStore.to_vehicle_infos(records, total_steps)))
 
 
 def calculate_B(initial_vehicles: List[VehicleInfo], current_vehicles: List[VehicleInfo], scenario: Scenario,
                 total_steps: int) -> Dict[Tuple[int, int], float]:
     p: int = len(initial_vehicles)
 
-    initial_area_profiles: Dict[int, ndarray] = {}
-    for j in range(len(current_vehicles)):
-        initial_area_profiles[j], _ \
-            = GenerationHelp.generate_states(scenario, initial_vehicles[j].state, total_steps)
-
     B: Dict[Tuple[int, int], float] = {}
     for j in range(p):
-        new_states, _ = GenerationHelp.generate_states(scenario, current_vehicles[j].state, total_steps)
-        new_area_profile: ndarray = calculate_area_profile(flatten_dict_values(new_states))
+        initial_records: ndarray = GenerationHelp.generate_records(scenario, initial_vehicles[j].state, total_steps)
+        initial_area_profile: ndarray = _records_area_profile(initial_records, total_steps)
+        new_area_profile: ndarray = _records_area_profile(
+            GenerationHelp.generate_records(scenario, current_vehicles[j].state, total_steps), total_steps)
         state_j: MyState = current_vehicles[j].state
         initial_state_j: MyState = initial_vehicles[j].state
         n_j: int = len(state_j.variables)
@@ -118,7 +184,7 @@ def calculate_B(initial_vehicles: List[VehicleInfo], current_vehicles: List[Vehi
             if variation_ij == 0:
                 B[(i, j)] = -1
             else:
-                B[(i, j)] = norm((new_area_profile - initial_area_profiles[j]) / variation_ij)
+                B[(i, j)] = norm((new_area_profile - initial_area_profile) / variation_ij)
     return B
 
 
@@ -180,9 +246,8 @@ def binary_search(my: int, initial_vehicles_before: List[VehicleInfo], initial_v
             state_sum: float = initial_vehicles_before[s_i].state.variable(v_i) \
                                + initial_vehicles_after[s_i].state.variable(v_i)
             current_vehicles[s_i].state.set_variable(v_i, 0.5 * state_sum)
-            current_area: ndarray = calculate_area_profile(
-                flatten_dict_values(
-                    GenerationHelp.generate_states(scenario, current_vehicles[s_i].state, total_steps)[0]))
+            current_area: ndarray = _records_area_profile(
+                GenerationHelp.generate_records(scenario, current_vehicles[s_i].state, total_steps), total_steps)
             if all(current_area > 0):
                 return current_vehicles[s_i].state.variable(v_i)
             else:
@@ -291,9 +356,13 @@ def optimized_scenario(initial_vehicles: List[VehicleInfo], epsilon: float, it_m
             # within the given amount of steps
             # FIXME Only ego vehicle considered
             current_initial_position: Point = Point(current_initial_vehicles[0].state.state.position)
-            # FIXME Only first goal region entry recognized
-            goal_region: Polygon = planning_problem.goal.state_list[0].position.shapely_object
-            distance_to_goal_region: float = current_initial_position.distance(goal_region)
+            if isinstance(scenario, CompiledScenario) and scenario.goal is not None:
+                # Considers the goal regions of all goal states
+                distance_to_goal_region: float = scenario.goal_distance(current_initial_vehicles[0].state.state.position)
+            else:
+                # FIXME Only first goal region entry recognized
+                goal_region: Polygon = planning_problem.goal.state_list[0].position.shapely_object
+                distance_to_goal_region = current_initial_position.distance(goal_region)
             min_velocity: float = distance_to_goal_region / (scenario.dt * total_steps)
             print("min_velocity: " + str(min_velocity))
             # FIXME Really use delta_a0?
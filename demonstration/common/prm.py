@@ -1,7 +1,13 @@
-from typing import List, Tuple, Optional
+from heapq import heappush, heappop
+from itertools import count
+from typing import List, Tuple, Optional, Dict, Union, TYPE_CHECKING
 
+import numpy as np
 from commonroad.scenario.trajectory import State
-from numpy.linalg import norm
+from scipy.spatial import cKDTree
+
+if TYPE_CHECKING:
+    from common.compiled import CompiledScenario
 
 
 class DijkstraNode:
@@ -19,46 +25,157 @@ class DijkstraNode:
         self.previous = previous
 
 
-def dijkstra_search(start_state: State, goal_states: List[State], states: List[State]) \
-        -> Optional[Tuple[List[State], float]]:
-    # NOTE The names white/grey/black may be confusing. The naming is solely based on
-    # https://github.com/AtsushiSakai/PythonRobotics#probabilistic-road-map-prm-planning
+class _Layer:
+    """
+    Contains all nodes of a single time step together with their positions and orientations as arrays.
+    """
+
+    def __init__(self, nodes: List[DijkstraNode], max_distance: Optional[float]):
+        self.nodes = nodes
+        self.positions: np.ndarray = np.array([node.state.position for node in nodes], dtype=float).reshape(-1, 2)
+        self.orientations: np.ndarray = np.array([node.state.orientation for node in nodes], dtype=float)
+        self.costs: np.ndarray = np.full(len(nodes), np.inf)
+        self.tree: Optional[cKDTree] = cKDTree(self.positions) if max_distance is not None and nodes else None
+
 
-    # NOTE Per definition there is an edge from state A to state B if and only if A.time_step == B.time_step - 1
-    if start_state in states:
-        states.remove(start_state)
+def _goal_states(goal: Union[List[State], 'CompiledScenario'], start_state: State, states: List[State]) \
+        -> List[State]:
+    """
+    :return: The given goal states or, if a compiled scenario is given, all states except the start state whose
+    positions lie within its goal region.
+    """
+    from common.compiled import CompiledScenario
+    if not isinstance(goal, CompiledScenario):
+        return goal
+    candidates: List[State] = [state for state in states if state is not start_state]
+    positions: np.ndarray = np.array([state.position for state in candidates], dtype=float).reshape(-1, 2)
+    return [state for state, in_goal in zip(candidates, goal.goal_contains(positions)) if in_goal]
 
-    # NOTE White and grey nodes refer to their previous node (second element in tuple)
-    white_nodes: List[DijkstraNode] = []
-    grey_nodes: List[DijkstraNode] = [DijkstraNode(start_state, costs=0)]
-    black_nodes: List[DijkstraNode] = []
+
+def _create_layers(start_state: State, goal: Union[List[State], 'CompiledScenario'], states: List[State],
+                   max_distance: Optional[float]) -> Dict[int, _Layer]:
+    """
+    Groups the nodes of all goal states and all states except the start state by their time steps.
+    """
+    goal_states: List[State] = _goal_states(goal, start_state, states)
+    layers: Dict[int, List[DijkstraNode]] = {}
+    goal_ids = set(map(id, goal_states))
     for goal_state in goal_states:
-        if goal_state in states:
-            states.remove(goal_state)
-        black_nodes.append(DijkstraNode(goal_state, is_goal_node=True))
+        layers.setdefault(goal_state.time_step, []).append(DijkstraNode(goal_state, is_goal_node=True))
     for state in states:
-        black_nodes.append(DijkstraNode(state))
-
-    next_white: DijkstraNode = DijkstraNode(None)
-    while grey_nodes != [] and not next_white.is_goal_node:
-        next_white: DijkstraNode = min(grey_nodes, key=lambda gp: gp.costs)
-        grey_nodes.remove(next_white)
-        white_nodes.append(next_white)
-        for black in black_nodes:
-            if next_white.state.time_step == black.state.time_step - 1:
-                # NOTE The costs recognize the distance of positions and the difference in the orientation of two states
-                costs: float = black.costs \
-                               + norm(next_white.state.position - black.state.position) \
-                               * abs(next_white.state.orientation - black.state.orientation)
-                grey_nodes.append(
-                    DijkstraNode(black.state, is_goal_node=black.is_goal_node, costs=costs, previous=next_white))
-                black_nodes.remove(black)
-
-    if next_white.is_goal_node:
-        costs: float = next_white.costs
-        path: List[State] = []
-        current: DijkstraNode = next_white
-        while current.previous:
-            path.append(current.state)
-            current = current.previous
-        return path, costs
+        if state is not start_state and id(state) not in goal_ids:
+            layers.setdefault(state.time_step, []).append(DijkstraNode(state))
+    return {time_step: _Layer(nodes, max_distance) for time_step, nodes in layers.items()}
+
+
+def dijkstra_search(start_state: State, goal_states: Union[List[State], 'CompiledScenario'], states: List[State],
+                    max_distance: Optional[float] = None) -> Optional[Tuple[List[State], float]]:
+    """
+    Searches the cheapest path from the start state to any of the goal states. There is an edge from state A to state B
+    if and only if A.time_step == B.time_step - 1. The costs of an edge are the distance of the positions of both states
+    multiplied by the difference of their orientations.
+    :param start_state: The state to start at.
+    :param goal_states: The states to reach. If a compiled scenario is given all states within its goal region are the
+    states to reach.
+    :param states: All states which may be part of the path.
+    :param max_distance: If set only states of the next time step within this distance are considered as successors.
+    :return: A tuple containing the states of the path starting at the reached goal state and ending with the successor
+    of the start state and the costs of the path. None if no goal state is reachable.
+    """
+    indexed_layers: Dict[int, _Layer] = _create_layers(start_state, goal_states, states, max_distance)
+
+    # NOTE Instead of decreasing the key of a node its new costs are pushed and outdated entries are skipped
+    sequence = count()  # Makes entries with equal costs comparable
+    start: DijkstraNode = DijkstraNode(start_state, costs=0)
+    heap: List[Tuple[float, int, DijkstraNode]] = [(0, next(sequence), start)]
+    while heap:
+        costs, _, current = heappop(heap)
+        if costs > current.costs:
+            continue  # Outdated entry
+        if current.is_goal_node:
+            path: List[State] = []
+            while current.previous:
+                path.append(current.state)
+                current = current.previous
+            return path, costs
+
+        successors: Optional[_Layer] = indexed_layers.get(current.state.time_step + 1)
+        if successors is None:
+            continue
+        if successors.tree is None:
+            candidates: np.ndarray = np.arange(len(successors.nodes))
+        else:
+            candidates = np.array(successors.tree.query_ball_point(current.state.position, max_distance), dtype=int)
+        if len(candidates) == 0:
+            continue
+        # NOTE The costs recognize the distance of positions and the difference in the orientation of two states
+        new_costs: np.ndarray = costs \
+            + np.linalg.norm(successors.positions[candidates] - current.state.position, axis=1) \
+            * np.abs(successors.orientations[candidates] - current.state.orientation)
+        improved: np.ndarray = new_costs < successors.costs[candidates]
+        for i, new_cost in zip(candidates[improved], new_costs[improved]):
+            successors.costs[i] = new_cost
+            successor: DijkstraNode = successors.nodes[i]
+            successor.costs = float(new_cost)
+            successor.previous = current
+            heappush(heap, (successor.costs, next(sequence), successor))
+    return None
+
+
+def layered_search(start_state: State, goal_states: Union[List[State], 'CompiledScenario'], states: List[State],
+                   chunk_size: int = 1 << 22) -> Optional[Tuple[List[State], float]]:
+    """
+    Searches the cheapest path like dijkstra_search(...) does. Since there are only edges between states of consecutive
+    time steps the graph is processed layer by layer. For each layer the costs of all edges from the previous layer are
+    calculated as a matrix and the cheapest predecessor of each state is selected at once.
+    :param start_state: The state to start at.
+    :param goal_states: The states to reach. If a compiled scenario is given all states within its goal region are the
+    states to reach.
+    :param states: All states which may be part of the path.
+    :param chunk_size: The maximum number of edge costs calculated at once. This limits the memory required for
+    layers containing many states.
+    :return: A tuple containing the states of the path starting at the reached goal state and ending with the successor
+    of the start state and the costs of the path. None if no goal state is reachable.
+    """
+    indexed_layers: Dict[int, _Layer] = _create_layers(start_state, goal_states, states, None)
+    previous_positions: np.ndarray = np.array([start_state.position], dtype=float)
+    previous_orientations: np.ndarray = np.array([start_state.orientation], dtype=float)
+    previous_costs: np.ndarray = np.zeros(1)
+    predecessors: List[np.ndarray] = []
+    best_goal: Optional[Tuple[float, int, int]] = None  # The costs, the layer and the index of the cheapest goal
+    time_step: int = start_state.time_step + 1
+    while time_step in indexed_layers and np.isfinite(previous_costs).any():
+        layer: _Layer = indexed_layers[time_step]
+        layer_predecessors: np.ndarray = np.zeros(len(layer.nodes), dtype=int)
+        rows_per_chunk: int = max(1, chunk_size // len(previous_costs))
+        for first in range(0, len(layer.nodes), rows_per_chunk):
+            last: int = min(first + rows_per_chunk, len(layer.nodes))
+            # NOTE The costs recognize the distance of positions and the difference in the orientation of two states
+            costs: np.ndarray = previous_costs[np.newaxis, :] \
+                + np.linalg.norm(layer.positions[first:last, np.newaxis, :] - previous_positions[np.newaxis, :, :],
+                                 axis=2) \
+                * np.abs(layer.orientations[first:last, np.newaxis] - previous_orientations[np.newaxis, :])
+            layer_predecessors[first:last] = np.argmin(costs, axis=1)
+            layer.costs[first:last] = costs[np.arange(last - first), layer_predecessors[first:last]]
+        predecessors.append(layer_predecessors)
+
+        # Paths end at goal states so goal states are no predecessors
+        is_goal: np.ndarray = np.array([node.is_goal_node for node in layer.nodes], dtype=bool)
+        if is_goal.any():
+            goal_index: int = int(np.flatnonzero(is_goal)[np.argmin(layer.costs[is_goal])])
+            if np.isfinite(layer.costs[goal_index]) \
+                    and (best_goal is None or layer.costs[goal_index] < best_goal[0]):
+                best_goal = (float(layer.costs[goal_index]), len(predecessors) - 1, goal_index)
+        previous_positions = layer.positions
+        previous_orientations = layer.orientations
+        previous_costs = np.where(is_goal, np.inf, layer.costs)
+        time_step += 1
+
+    if best_goal is None:
+        return None
+    costs, layer_index, node_index = best_goal
+    path: List[State] = []
+    for depth in range(layer_index, -1, -1):
+        path.append(indexed_layers[start_state.time_step + 1 + depth].nodes[node_index].state)
+        node_index = int(predecessors[depth][node_index])
+    return path, costs
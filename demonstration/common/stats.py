@@ -0,0 +1,108 @@
+import json
+from ctypes import c_double
+from logging import info
+from multiprocessing import RawArray
+from typing import Dict, List, Optional, Any, Tuple
+
+import numpy as np
+
+
+class GenerationStats:
+    """
+    Collects counters and timers of the stages of a single generation. (See GenerationHelp.generate_records(...)) The
+    counters of the workers are stored in shared memory. Each worker only writes its own row so no locking is needed.
+    All timers are given in seconds.
+    """
+    worker_fields: Tuple[str, ...] = (
+        'claims',  # Records taken from the queue
+        'queue_wait_time',  # Time spent in claim() waiting for a record to expand
+        'propagated',  # Candidates created by propagating a record with all yaw steps
+        'propagation_time',
+        'duplicate_hits',  # Candidates dropped since they are close to an existing record
+        'duplicate_misses',
+        'dedup_time',
+        'road_rejects',  # Candidates not completely on the lanelets
+        'road_time',
+        'obstacle_rejects',  # Candidates on the lanelets but colliding with an obstacle
+        'obstacle_time',
+        'accepted',  # Candidates added to the store
+        'append_duplicates',  # Candidates dropped since another worker added a close record in the meantime
+        'append_time',
+        'last_done',  # Timestamp of the last record this worker finished
+        'completion_detected'  # Timestamp when this worker noticed that there is nothing left to expand
+    )
+    _timestamps: Tuple[str, ...] = ('last_done', 'completion_detected')
+    _columns: Dict[str, int] = {name: i for i, name in enumerate(worker_fields)}
+
+    def __init__(self):
+        self.workers: List[Dict[str, float]] = []
+        self.accepted_per_time_step: Dict[int, int] = {}
+        self.num_states_processed: int = 0
+        self.cache_hit: bool = False
+        self.setup_time: float = 0  # Building the indices and the store
+        self.total_time: float = 0
+        # The time between the last record being finished and the last worker noticing that the generation is complete
+        self.completion_detection_time: float = 0
+        self._counters: Optional[np.ndarray] = None
+
+    def start(self, num_workers: int) -> None:
+        """
+        Allocates the shared counters. Has to be called before the workers are forked.
+        """
+        self._counters = np.frombuffer(RawArray(c_double, num_workers * len(GenerationStats.worker_fields)),
+                                       dtype=np.float64).reshape(num_workers, len(GenerationStats.worker_fields))
+
+    def add(self, worker: int, **values: float) -> None:
+        """
+        Adds the given values to the counters of the given worker.
+        """
+        for name, value in values.items():
+            self._counters[worker, GenerationStats._columns[name]] += value
+
+    def set(self, worker: int, name: str, value: float) -> None:
+        self._counters[worker, GenerationStats._columns[name]] = value
+
+    def finish(self, records: np.ndarray) -> None:
+        """
+        Copies the counters of all workers and derives the statistics of the generated records.
+        :param records: The records generated. (See StatesStore)
+        """
+        if self._counters is not None:
+            self.workers = [dict(zip(GenerationStats.worker_fields, map(float, row))) for row in self._counters]
+            last_done: np.ndarray = self._counters[:, GenerationStats._columns['last_done']]
+            detected: np.ndarray = self._counters[:, GenerationStats._columns['completion_detected']]
+            if last_done.max() > 0:
+                self.completion_detection_time = float(detected.max() - last_done.max())
+            self._counters = None
+        time_steps, counts = np.unique(records['time_step'][1:], return_counts=True)
+        self.accepted_per_time_step = {int(t): int(c) for t, c in zip(time_steps, counts)}
+        self.num_states_processed = len(records)
+
+    def totals(self) -> Dict[str, float]:
+        """
+        :return: The sums of all counters and timers over all workers.
+        """
+        return {name: sum(worker[name] for worker in self.workers)
+                for name in GenerationStats.worker_fields if name not in GenerationStats._timestamps}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'num_states_processed': self.num_states_processed,
+            'cache_hit': self.cache_hit,
+            'setup_time': self.setup_time,
+            'total_time': self.total_time,
+            'completion_detection_time': self.completion_detection_time,
+            'accepted_per_time_step': self.accepted_per_time_step,
+            'totals': self.totals(),
+            'workers': [{name: value for name, value in worker.items() if name not in GenerationStats._timestamps}
+                        for worker in self.workers]
+        }
+
+    def to_json(self, indent: Optional[int] = None) -> str:
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def log(self) -> None:
+        """
+        Logs all statistics as a single JSON line.
+        """
+        info("Generation stats: " + self.to_json())
@@ -0,0 +1,404 @@
+import json
+import os
+import platform
+import resource
+import sys
+from argparse import ArgumentParser, Namespace
+from copy import copy, deepcopy
+from datetime import datetime
+from multiprocessing import get_context
+from multiprocessing.connection import Connection
+from statistics import median
+from time import perf_counter
+from typing import Dict, Any, List, Callable, Optional, Tuple
+
+import numpy as np
+from commonroad.planning.planning_problem import PlanningProblem
+from commonroad.scenario.scenario import Scenario
+from commonroad.scenario.trajectory import State
+from shapely.geometry import Polygon
+
+from common import load_scenario, MyState, VehicleInfo, flatten_dict_values, is_valid
+from common import optimizer
+from common.draw import DrawHelp
+from common.generation import GenerationHelp, GenerationConfig
+from common.index import to_shapely
+from common.optimizer import calculate_area_profile, optimized_scenario
+from common.prm import dijkstra_search
+from common.stats import GenerationStats
+
+scenarios_dir: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scenarios")
+results_path: str = "benchmark_results.json"
+baseline_path: str = "benchmark_baseline.json"
+time_steps_grid: List[int] = [5, 10, 15]
+yaw_steps_grid: List[int] = [8, 16, 32]  # Only varied for generate_states
+num_threads_grid: List[int] = [1, 4, 8]  # Only varied for generate_states
+optimize_time_steps_grid: List[int] = [5]  # optimized_scenario generates states repeatedly so only short horizons
+initial_velocity: float = 15  # The velocity of the ego vehicle in all scenarios [m/s]
+repetitions: int = 3
+case_timeout: float = 900  # [s] Cases taking longer are recorded as failed
+memory_interval: float = 0.05  # [s] The interval the memory usage of all processes of a case is sampled in
+tolerance: float = 0.1  # Relative change of the wall time which is reported as regression or improvement
+min_difference: float = 0.01  # [s] Smaller changes of the wall time are considered as noise
+
+# A benchmark prepares its input outside of the measurement and returns a function doing the measured work. That
+# function returns the number of states it processed or None if there is no such number.
+_Benchmark = Callable[[Scenario, PlanningProblem, int], Callable[[], Optional[int]]]
+
+
+def _initial_state(planning_problem: PlanningProblem) -> MyState:
+    ego_vehicle: MyState = MyState(copy(planning_problem.initial_state))
+    MyState.set_variable_to(ego_vehicle.state, 0, initial_velocity)
+    return ego_vehicle
+
+
+def _generate(scenario: Scenario, planning_problem: PlanningProblem, time_steps: int) -> List[VehicleInfo]:
+    valid_converted, _ = GenerationHelp.generate_states(scenario, _initial_state(planning_problem), time_steps)
+    return flatten_dict_values(valid_converted)
+
+
+def _clear_optimizer_caches() -> None:
+    # NOTE Otherwise every repetition after the first one only measures a cache lookup
+    optimizer._layer_unions.clear()
+    optimizer._area_profiles.clear()
+
+
+def _goal_states(planning_problem: PlanningProblem, time_step: int) -> List[State]:
+    goal_states: List[State] = []
+    for goal in planning_problem.goal.state_list:
+        position = getattr(goal, 'position', None)
+        if position is None:
+            continue
+        orientation = getattr(goal, 'orientation', 0)
+        if hasattr(orientation, 'start'):
+            orientation = (orientation.start + orientation.end) / 2
+        goal_states.append(State(position=np.array(to_shapely(position).centroid.coords[0]), orientation=orientation,
+                                 time_step=time_step))
+    return goal_states
+
+
+def bench_generate_states(scenario: Scenario, planning_problem: PlanningProblem,
+                          time_steps: int) -> Callable[[], Optional[int]]:
+    def run() -> int:
+        _, num_states_processed = GenerationHelp.generate_states(scenario, _initial_state(planning_problem),
+                                                                 time_steps)
+        return num_states_processed
+
+    return run
+
+
+def bench_is_valid(scenario: Scenario, planning_problem: PlanningProblem,
+                   time_steps: int) -> Callable[[], Optional[int]]:
+    vehicles: List[VehicleInfo] = _generate(scenario, planning_problem, time_steps)
+
+    def run() -> int:
+        for vehicle in vehicles:
+            is_valid(vehicle, scenario)
+        return len(vehicles)
+
+    return run
+
+
+def bench_calculate_area_profile(scenario: Scenario, planning_problem: PlanningProblem,
+                                 time_steps: int) -> Callable[[], Optional[int]]:
+    vehicles: List[VehicleInfo] = _generate(scenario, planning_problem, time_steps)
+
+    def run() -> int:
+        _clear_optimizer_caches()
+        calculate_area_profile(vehicles)
+        return len(vehicles)
+
+    return run
+
+
+def bench_union_to_polygon(scenario: Scenario, planning_problem: PlanningProblem,
+                           time_steps: int) -> Callable[[], Optional[int]]:
+    drawables: List[Polygon] = [Polygon(vehicle.footprint)
+                                for vehicle in _generate(scenario, planning_problem, time_steps)]
+
+    def run() -> int:
+        DrawHelp.union_to_polygon(drawables)
+        return len(drawables)
+
+    return run
+
+
+def bench_dijkstra_search(scenario: Scenario, planning_problem: PlanningProblem,
+                          time_steps: int) -> Callable[[], Optional[int]]:
+    states: List[State] = [vehicle.state.state for vehicle in _generate(scenario, planning_problem, time_steps)]
+    start_state: State = _initial_state(planning_problem).state
+    goal_states: List[State] = _goal_states(planning_problem, start_state.time_step + time_steps + 1)
+
+    def run() -> int:
+        dijkstra_search(start_state, goal_states, states)
+        return len(states)
+
+    return run
+
+
+def bench_optimized_scenario(scenario: Scenario, planning_problem: PlanningProblem,
+                             time_steps: int) -> Callable[[], Optional[int]]:
+    def run() -> None:
+        _clear_optimizer_caches()
+        # NOTE The optimization modifies the scenario, so each run starts from an unmodified copy
+        fresh_scenario, fresh_planning_problem = deepcopy(scenario), deepcopy(planning_problem)
+        vehicles: List[VehicleInfo] = [VehicleInfo(_initial_state(fresh_planning_problem), -1)]
+        optimized_scenario(vehicles, 3000, 10, 10, np.arange(time_steps, 0, -1), fresh_scenario,
+                           fresh_planning_problem)
+
+    return run
+
+
+benchmarks: Dict[str, _Benchmark] = {
+    'generate_states': bench_generate_states,
+    'is_valid': bench_is_valid,
+    'calculate_area_profile': bench_calculate_area_profile,
+    'union_to_polygon': bench_union_to_polygon,
+    'dijkstra_search': bench_dijkstra_search,
+    'optimized_scenario': bench_optimized_scenario
+}
+
+
+def create_cases(benchmark_names: List[str], scenario_names: List[str]) -> List[Dict[str, Any]]:
+    """
+    Creates all combinations of benchmarks, scenarios and parameters to measure.
+    """
+    cases: List[Dict[str, Any]] = []
+    for scenario_name in scenario_names:
+        for benchmark in benchmark_names:
+            if benchmark == 'generate_states':
+                params: List[Tuple[int, int, int]] = [(t, y, n) for t in time_steps_grid for y in yaw_steps_grid
+                                                      for n in num_threads_grid]
+            elif benchmark == 'optimized_scenario':
+                params = [(t, GenerationConfig.yaw_steps, GenerationConfig.num_threads)
+                          for t in optimize_time_steps_grid]
+            else:
+                params = [(t, GenerationConfig.yaw_steps, GenerationConfig.num_threads) for t in time_steps_grid]
+            for time_steps, yaw_steps, num_threads in params:
+                cases.append({
+                    'benchmark': benchmark,
+                    'scenario': scenario_name,
+                    'params': {'time_steps': time_steps, 'yaw_steps': yaw_steps, 'num_threads': num_threads}
+                })
+    return cases
+
+
+def case_key(case: Dict[str, Any]) -> str:
+    params: Dict[str, int] = case['params']
+    return case['benchmark'] + "|" + case['scenario'] + "|" \
+        + ",".join(name + "=" + str(params[name]) for name in sorted(params))
+
+
+def _peak_process_rss_mb() -> float:
+    """
+    :return: The largest peak resident set size of this process and any of its terminated children in MiB. This is not
+    the combined memory usage of processes running at the same time. (See _total_memory_mb(...))
+    """
+    peak: int = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                    resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # NOTE ru_maxrss is given in bytes on macOS and in KiB on Linux
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / (1 << 10)
+
+
+def _process_tree(pid: int) -> List[int]:
+    """
+    :return: The ids of the given process and all its running descendants.
+    """
+    children: Dict[int, List[int]] = {}
+    for name in os.listdir("/proc"):
+        if name.isdigit():
+            try:
+                with open(os.path.join("/proc", name, "stat")) as stat:
+                    # NOTE The name of the executable may contain spaces so the fields are counted from its end
+                    parent: int = int(stat.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue  # Terminated in the meantime
+            children.setdefault(parent, []).append(int(name))
+    tree: List[int] = [pid]
+    for process in tree:
+        tree.extend(children.get(process, []))
+    return tree
+
+
+def _process_memory_kib(pid: int) -> int:
+    """
+    :return: The proportional set size of the given process in KiB if available and its resident set size otherwise. The
+    proportional set size counts pages shared with other processes (E.g. forked workers) only proportionally so the
+    sizes of several processes can be summed up.
+    """
+    for path, field in [("smaps_rollup", "Pss:"), ("status", "VmRSS:")]:
+        try:
+            with open(os.path.join("/proc", str(pid), path)) as file:
+                for line in file:
+                    if line.startswith(field):
+                        return int(line.split()[1])
+        except (OSError, ValueError):
+            continue
+    return 0
+
+
+def _total_memory_mb(pid: int) -> Optional[float]:
+    """
+    :return: The memory currently used by the given process and all its descendants together in MiB. None if it can
+    not be determined on this platform.
+    """
+    if not os.path.isdir("/proc"):
+        return None
+    return sum(_process_memory_kib(process) for process in _process_tree(pid)) / (1 << 10)
+
+
+def _measure(case: Dict[str, Any], connection: Connection) -> None:
+    """
+    Measures a single case. It is run in a process of its own so the peak memory usage only covers this case.
+    """
+    result: Dict[str, Any] = {}
+    try:
+        params: Dict[str, int] = case['params']
+        GenerationConfig.yaw_steps = params['yaw_steps']
+        GenerationConfig.num_threads = params['num_threads']
+        scenario, planning_problem = load_scenario(os.path.join(scenarios_dir, case['scenario']))
+        run: Callable[[], Optional[int]] = benchmarks[case['benchmark']](scenario, planning_problem,
+                                                                          params['time_steps'])
+        wall_times: List[float] = []
+        num_states: Optional[int] = None
+        for _ in range(repetitions):
+            start_time: float = perf_counter()
+            num_states = run()
+            wall_times.append(perf_counter() - start_time)
+        wall_time: float = median(wall_times)
+        result.update({
+            'wall_time': wall_time,
+            'wall_times': wall_times,
+            'states': num_states,
+            'states_per_second': num_states / wall_time if num_states is not None and wall_time > 0 else None
+        })
+        if case['benchmark'] == 'generate_states':
+            # An additional instrumented run shows which stage of the generation takes the time
+            stats: GenerationStats = GenerationStats()
+            GenerationHelp.generate_states(scenario, _initial_state(planning_problem), params['time_steps'], stats)
+            result['stage_stats'] = stats.to_dict()
+    except Exception as ex:
+        result['error'] = type(ex).__name__ + ": " + str(ex)
+    result['peak_process_rss_mb'] = _peak_process_rss_mb()
+    connection.send(result)
+    connection.close()
+
+
+def run_case(case: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Runs the given case in a process of its own and returns the case together with its measurements. While the case
+    runs the memory used by its process and all the worker processes it starts is sampled. The peak of their sum is
+    reported as peak_rss_mb. If it can not be sampled on this platform the largest peak of any single process is
+    reported instead.
+    """
+    # NOTE The workers of the generation require fork. The parent only holds the imported modules so its memory hardly
+    # contributes to the peak memory usage of the case.
+    context = get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_measure, args=(case, sender))
+    process.start()
+    sender.close()
+    result: Dict[str, Any] = dict(case)
+    peak_total: Optional[float] = None
+    deadline: float = perf_counter() + case_timeout
+    received: bool = False
+    while not received and perf_counter() < deadline:
+        total: Optional[float] = _total_memory_mb(process.pid)
+        if total is not None:
+            peak_total = max(total, peak_total or 0)
+        received = receiver.poll(min(memory_interval, max(deadline - perf_counter(), 0)))
+    if received:
+        try:
+            result.update(receiver.recv())
+        except EOFError:
+            result['error'] = "The benchmark process died with exit code " + str(process.exitcode)
+    else:
+        process.terminate()
+        result['error'] = "Timed out after " + str(case_timeout) + "s"
+    process.join()
+    if 'peak_process_rss_mb' in result:
+        result['peak_rss_mb'] = result['peak_process_rss_mb'] if peak_total is None else peak_total
+    return result
+
+
+def compare(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]]) -> Tuple[int, int]:
+    """
+    Prints the change of the wall time of every result compared to the baseline.
+    :return: The number of regressions and improvements.
+    """
+    baseline_by_key: Dict[str, Dict[str, Any]] = {case_key(entry): entry for entry in baseline}
+    regressions: int = 0
+    improvements: int = 0
+    for result in results:
+        key: str = case_key(result)
+        reference: Optional[Dict[str, Any]] = baseline_by_key.get(key)
+        if 'error' in result:
+            print("FAILED    " + key + ": " + result['error'])
+        elif reference is None or 'error' in reference:
+            print("NEW       " + key + ": " + "{:.3f}s".format(result['wall_time']))
+        else:
+            ratio: float = result['wall_time'] / reference['wall_time'] if reference['wall_time'] > 0 else 1
+            significant: bool = abs(result['wall_time'] - reference['wall_time']) >= min_difference
+            if significant and ratio > 1 + tolerance:
+                status: str = "SLOWER"
+                regressions += 1
+            elif significant and ratio < 1 - tolerance:
+                status = "FASTER"
+                improvements += 1
+            else:
+                status = "SAME"
+            print("{:<10}{}: {:.3f}s -> {:.3f}s ({:+.1%}), peak RSS {:.0f} -> {:.0f} MiB".format(
+                status, key, reference['wall_time'], result['wall_time'], ratio - 1, reference['peak_rss_mb'],
+                result['peak_rss_mb']))
+    return regressions, improvements
+
+
+def parse_args() -> Namespace:
+    parser: ArgumentParser = ArgumentParser(description="Measures the generation, validity checks, area profiles, "
+                                                        "unions, searches and optimization on all scenarios.")
+    parser.add_argument('--benchmarks', nargs='+', choices=list(benchmarks.keys()), default=list(benchmarks.keys()))
+    parser.add_argument('--scenarios', nargs='+', default=sorted(f for f in os.listdir(scenarios_dir)
+                                                                 if f.endswith(".xml")))
+    parser.add_argument('--output', default=results_path)
+    parser.add_argument('--baseline', default=baseline_path)
+    parser.add_argument('--update-baseline', action='store_true',
+                        help="Store the results as new baseline. (Done anyway if there is no baseline, yet)")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args: Namespace = parse_args()
+    cases: List[Dict[str, Any]] = create_cases(args.benchmarks, args.scenarios)
+    results: List[Dict[str, Any]] = []
+    for i, case in enumerate(cases):
+        result: Dict[str, Any] = run_case(case)
+        results.append(result)
+        print("[{}/{}] {}: {}".format(i + 1, len(cases), case_key(case), result.get('error') or
+                                      "{:.3f}s, {:.0f} MiB".format(result['wall_time'], result['peak_rss_mb'])))
+
+    report: Dict[str, Any] = {
+        'created': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'repetitions': repetitions,
+        'results': results
+    }
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+
+    regressions: int = 0
+    if os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline) as baseline:
+            regressions, improvements = compare(results, json.load(baseline)['results'])
+        print(str(regressions) + " regressions, " + str(improvements) + " improvements (tolerance "
+              + "{:.0%}".format(tolerance) + ")")
+    else:
+        with open(args.baseline, "w") as baseline:
+            json.dump(report, baseline, indent=2)
+        print("Stored results as baseline in " + args.baseline)
+    sys.exit(1 if regressions > 0 else 0)
+
+
+if __name__ == '__main__':
+    main()
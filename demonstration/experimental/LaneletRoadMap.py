@@ -0,0 +1,207 @@
+import os
+from datetime import datetime
+from hashlib import sha1
+from logging import warning
+from tempfile import mkstemp
+from typing import Tuple, Optional, List
+from zipfile import BadZipFile
+
+import matplotlib.pyplot as plt
+import numpy as np
+from commonroad.geometry.shape import Rectangle
+from commonroad.scenario.scenario import Scenario
+from scipy.spatial import cKDTree
+from shapely.geometry.base import BaseGeometry
+from shapely.ops import unary_union
+
+from common import load_scenario
+from common.draw import DrawHelp
+from common.index import RoadIndex, scenario_fingerprint, to_shapely, contains_xy, prepare
+from probabilistic_road_map import to_csr, shortest_path
+
+scenario_path: str = '../scenarios/DEU_B471-1_1_T-1_mod.xml'
+cache_dir: str = "roadmap_cache"  # Built road maps are stored there and reused by later runs
+num_samples: int = 5000
+num_knn: int = 10  # The maximum number of edges of a sample
+num_candidates: int = 3 * num_knn  # The number of nearest samples checked for edges of a sample
+max_edge_length: float = 10.0  # [m]
+edge_step: float = 0.5  # The distance between the points of an edge checked against the road and obstacles [m]
+seed: int = 0
+
+
+class LaneletRoadMap:
+    """
+    Represents a probabilistic road map whose samples and edges all lie on the lanelets of a scenario and do not touch
+    any static obstacle. The edges are stored as compressed sparse row adjacency. (See probabilistic_road_map.to_csr)
+    """
+
+    def __init__(self, samples: np.ndarray, indptr: np.ndarray, indices: np.ndarray, weights: np.ndarray):
+        self.samples = samples
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self._tree: cKDTree = cKDTree(samples)
+
+    @staticmethod
+    def key(scenario: Scenario) -> str:
+        """
+        Calculates a key identifying the road map of the given scenario built with the current settings.
+        """
+        return sha1(repr((scenario_fingerprint(scenario), num_samples, num_knn, num_candidates, max_edge_length,
+                          edge_step, seed)).encode()).hexdigest()
+
+    @staticmethod
+    def _free_space(scenario: Scenario) -> Tuple[BaseGeometry, Optional[BaseGeometry]]:
+        road: BaseGeometry = RoadIndex.of(scenario).road
+        obstacles: List[BaseGeometry] = [to_shapely(obstacle.occupancy_at_time(0).shape)
+                                         for obstacle in scenario.static_obstacles]
+        static_obstacles: Optional[BaseGeometry] = unary_union(obstacles) if obstacles else None
+        if static_obstacles is not None and prepare:
+            prepare(static_obstacles)
+        return road, static_obstacles
+
+    @staticmethod
+    def _are_free(points: np.ndarray, road: BaseGeometry, static_obstacles: Optional[BaseGeometry]) -> np.ndarray:
+        free: np.ndarray = np.asarray(contains_xy(road, points[:, 0], points[:, 1]), dtype=bool)
+        if static_obstacles is not None:
+            free &= ~np.asarray(contains_xy(static_obstacles, points[:, 0], points[:, 1]), dtype=bool)
+        return free
+
+    @staticmethod
+    def _are_edges_free(starts: np.ndarray, ends: np.ndarray, road: BaseGeometry,
+                        static_obstacles: Optional[BaseGeometry]) -> np.ndarray:
+        """
+        Checks which straight edges lie completely on the road and do not touch any static obstacle.
+        :param starts: The start points of all edges as array of shape (N, 2).
+        :param ends: The end points of all edges as array of shape (N, 2).
+        :return: An array of shape (N,) which is True for all free edges.
+        """
+        num_steps: np.ndarray = np.ceil(np.linalg.norm(ends - starts, axis=1) / edge_step).astype(int) + 1
+        edge: np.ndarray = np.repeat(np.arange(len(starts)), num_steps)
+        step: np.ndarray = np.arange(len(edge)) - np.repeat(np.cumsum(num_steps) - num_steps, num_steps)
+        fraction: np.ndarray = step / np.maximum(num_steps[edge] - 1, 1)
+        points: np.ndarray = starts[edge] + (ends[edge] - starts[edge]) * fraction[:, np.newaxis]
+        blocked: np.ndarray = ~LaneletRoadMap._are_free(points, road, static_obstacles)
+        return np.bincount(edge, weights=blocked, minlength=len(starts)) == 0
+
+    @staticmethod
+    def build(scenario: Scenario) -> 'LaneletRoadMap':
+        """
+        Samples positions on the lanelets of the given scenario and connects each of them with its nearest samples
+        which can be reached on a straight line.
+        """
+        road, static_obstacles = LaneletRoadMap._free_space(scenario)
+        min_x, min_y, max_x, max_y = road.bounds
+        random: np.random.RandomState = np.random.RandomState(seed)
+        samples: np.ndarray = np.empty((0, 2))
+        while len(samples) < num_samples:
+            missing: int = num_samples - len(samples)
+            candidates: np.ndarray = np.column_stack((random.uniform(min_x, max_x, 4 * missing),
+                                                      random.uniform(min_y, max_y, 4 * missing)))
+            samples = np.vstack((samples, candidates[LaneletRoadMap._are_free(candidates, road, static_obstacles)]
+                                 [:missing]))
+
+        # NOTE The nearest neighbor of each sample is the sample itself
+        distances, neighbors = cKDTree(samples).query(samples, k=min(num_candidates + 1, len(samples)),
+                                                      distance_upper_bound=max_edge_length)
+        distances, neighbors = distances[:, 1:], neighbors[:, 1:]
+        rows, cols = np.nonzero(np.isfinite(distances))
+        free: np.ndarray = np.zeros(distances.shape, dtype=bool)
+        free[rows, cols] = LaneletRoadMap._are_edges_free(samples[rows], samples[neighbors[rows, cols]],
+                                                          road, static_obstacles)
+        free &= np.cumsum(free, axis=1) <= num_knn  # Keep the nearest num_knn free edges of each sample
+        indptr, indices, weights \
+            = to_csr([neighbors[i][free[i]] for i in range(len(samples))], samples[:, 0], samples[:, 1])
+        return LaneletRoadMap(samples, indptr, indices, weights)
+
+    def save(self, path: str) -> None:
+        # Write to a temporary file first so other processes never load a partially written road map
+        handle, temporary_path = mkstemp(dir=os.path.dirname(path) or ".", suffix=".npz.tmp")
+        try:
+            with os.fdopen(handle, "wb") as file:
+                np.savez(file, samples=self.samples, indptr=self.indptr, indices=self.indices, weights=self.weights)
+            os.replace(temporary_path, path)
+        except OSError as ex:
+            warning("Could not store the road map " + path + ": " + str(ex))
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+    @staticmethod
+    def load(path: str) -> 'LaneletRoadMap':
+        with np.load(path) as data:
+            return LaneletRoadMap(data['samples'], data['indptr'], data['indices'], data['weights'])
+
+    @staticmethod
+    def of(scenario: Scenario, directory: str = cache_dir) -> 'LaneletRoadMap':
+        """
+        Loads the road map of the given scenario from the given directory. If there is none or it can not be read it is
+        built and stored there.
+        """
+        path: str = os.path.join(directory, LaneletRoadMap.key(scenario) + ".npz")
+        if os.path.exists(path):
+            try:
+                return LaneletRoadMap.load(path)
+            except (OSError, ValueError, KeyError, EOFError, BadZipFile) as ex:
+                warning("Could not load the stored road map " + path + ": " + str(ex) + ". It is built again.")
+        road_map: LaneletRoadMap = LaneletRoadMap.build(scenario)
+        os.makedirs(directory, exist_ok=True)
+        road_map.save(path)
+        return road_map
+
+    def _nearest_connectable(self, position: np.ndarray, road: BaseGeometry,
+                             static_obstacles: Optional[BaseGeometry]) -> Optional[int]:
+        distances, neighbors = self._tree.query(position, k=min(num_candidates, len(self.samples)),
+                                                distance_upper_bound=max_edge_length)
+        neighbors = np.atleast_1d(neighbors)[np.isfinite(np.atleast_1d(distances))]
+        if len(neighbors) == 0:
+            return None
+        free: np.ndarray = LaneletRoadMap._are_edges_free(np.repeat(position[np.newaxis], len(neighbors), axis=0),
+                                                          self.samples[neighbors], road, static_obstacles)
+        return int(neighbors[np.argmax(free)]) if free.any() else None
+
+    def plan(self, scenario: Scenario, start: np.ndarray, goal: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Searches the shortest path between the given positions along the road map.
+        :return: The positions of the path from the goal to the start as array of shape (N, 2) or None if there is no
+        path.
+        """
+        start, goal = np.asarray(start, dtype=float), np.asarray(goal, dtype=float)
+        road, static_obstacles = LaneletRoadMap._free_space(scenario)
+        start_id: Optional[int] = self._nearest_connectable(start, road, static_obstacles)
+        goal_id: Optional[int] = self._nearest_connectable(goal, road, static_obstacles)
+        if start_id is None or goal_id is None:
+            return None
+        path, _ = shortest_path((self.indptr, self.indices, self.weights), self.samples[:, 0], self.samples[:, 1],
+                                start_id, goal_id, use_heuristic=True)
+        if not path:
+            return None
+        return np.vstack((goal, self.samples[path], start))
+
+
+def main() -> None:
+    scenario, planning_problem = load_scenario(scenario_path)
+
+    start_time: datetime = datetime.now()
+    road_map: LaneletRoadMap = LaneletRoadMap.of(scenario)
+    print("Loading road map took " + str(datetime.now() - start_time))
+
+    goal_position = planning_problem.goal.state_list[0].position
+    if isinstance(goal_position, Rectangle):
+        goal_position = goal_position.center
+    start_time = datetime.now()
+    path: Optional[np.ndarray] = road_map.plan(scenario, planning_problem.initial_state.position, goal_position)
+    print("Planning took " + str(datetime.now() - start_time))
+
+    plt.figure(figsize=(25, 10))
+    DrawHelp.draw(DrawHelp.convert_to_drawable(scenario.lanelet_network))
+    plt.plot(road_map.samples[:, 0], road_map.samples[:, 1], ".b", markersize=1)
+    if path is None:
+        print("Could not find path to goal")
+    else:
+        plt.plot(path[:, 0], path[:, 1], "-r")
+    plt.gca().set_aspect('equal')
+    plt.show()
+
+
+if __name__ == '__main__':
+    main()
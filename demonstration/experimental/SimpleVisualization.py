@@ -9,48 +9,46 @@ from commonroad.planning.planning_problem import PlanningProblemSet, PlanningPro
 from commonroad.scenario.obstacle import DynamicObstacle
 from commonroad.scenario.scenario import Scenario
 from commonroad.scenario.trajectory import State
-from matplotlib.animation import ArtistAnimation
+from matplotlib.animation import FuncAnimation
 from matplotlib.artist import Artist
 
 from common import DrawHelp
+from common.export import FrameExporter
 
+num_time_steps: int = 21
+# If set the frames are streamed to this file before being shown. Paths ending with ".mp4" are encoded using ffmpeg. Any
+# other path is used as pattern for the paths of single images.
+output_path: Optional[str] = "2018-12-26_BasicUnoptimzedScenario.mp4"
 
 arrowprops: Dict = dict(facecolor='black', width=3)
 
 
-def createDynamicObstaclesArtists(dynamic_obstacles: List[DynamicObstacle]) -> List[List[Artist]]:
-    artists: List[List[Artist]] = []
-    for time_step in range(0, 21):
-        frame = []
-        for obstacle in dynamic_obstacles:
-            position: pltpat.Rectangle = DrawHelp.convert_to_drawable(obstacle, time_step)
-            drawable = DrawHelp.draw(position)
-            drawable.set_zorder(1000000)
-            frame.append(drawable)
-            frame.append(plt.annotate("participant", xy=(position.get_x() - 3, position.get_y()),
-                                      xytext=(position.get_x(), position.get_y() + 7),
-                                      arrowprops=arrowprops, zorder=100000))
-        artists.append(frame)
+def createDynamicObstaclesArtists(dynamic_obstacles: List[DynamicObstacle], time_step: int) -> List[Artist]:
+    frame: List[Artist] = []
+    for obstacle in dynamic_obstacles:
+        position: pltpat.Rectangle = DrawHelp.convert_to_drawable(obstacle, time_step)
+        drawable = DrawHelp.draw(position)
+        drawable.set_zorder(1000000)
+        frame.append(drawable)
+        frame.append(plt.annotate("participant", xy=(position.get_x() - 3, position.get_y()),
+                                  xytext=(position.get_x(), position.get_y() + 7),
+                                  arrowprops=arrowprops, zorder=100000))
+    return frame
 
-    return artists
 
+def create_prediction_artists(current_state: State) -> List[Artist]:
+    state_point: pltpat.Circle = pltpat.Circle(current_state.position, 2)
+    center = state_point.get_center()
+    return [plt.gca().add_patch(state_point),
+            plt.annotate("ego_vehicle", xy=center - (0, 2), xytext=center - (-2, 7), arrowprops=arrowprops)]
 
-def extend_frames_with_prediction(initial_state: State, frames: List[List[Artist]], delay_time_step_sec: float) \
-        -> List[List[Artist]]:
-    current_state: State = initial_state
-    for frame in frames:
-        state_point: pltpat.Circle = pltpat.Circle(current_state.position, 2)
-        frame.append(plt.gca().add_patch(state_point))
-        center = state_point.get_center()
-        annotation = plt.annotate("ego_vehicle", xy=center - (0, 2), xytext=center - (-2, 7), arrowprops=arrowprops)
-        frame.append(annotation)
 
-        delta_x: float = np.cos(current_state.orientation) * current_state.velocity * delay_time_step_sec
-        delta_y: float = np.sin(current_state.orientation) * current_state.velocity * delay_time_step_sec
-        translation: np.ndarray = np.array([delta_x, delta_y])
-        #current_state = current_state.translate_rotate(translation, 0)
-
-    return frames
+def predict_next_state(current_state: State, delay_time_step_sec: float) -> State:
+    delta_x: float = np.cos(current_state.orientation) * current_state.velocity * delay_time_step_sec
+    delta_y: float = np.sin(current_state.orientation) * current_state.velocity * delay_time_step_sec
+    translation: np.ndarray = np.array([delta_x, delta_y])
+    return State(position=current_state.position + translation, orientation=current_state.orientation,
+                 velocity=current_state.velocity, time_step=current_state.time_step + 1)
 
 
 def main() -> None:
@@ -75,18 +73,38 @@ def main() -> None:
         x, y = obstacle.occupancy_at_time(0).shape.center
         plt.annotate("static obstacle", xy=(x + 2, y + 3), xytext=(x, y + 9), arrowprops=arrowprops)
 
-    # Generates frames of dynamic obstacles
-    frames: List[List[Artist]] = createDynamicObstaclesArtists(scenario.dynamic_obstacles)
-
-    # Add predictions of ego vehicle to the frames
-    extend_frames_with_prediction(planning_problem.initial_state, frames, scenario.dt)
-
-    # Add an animation of the frames
-    # NOTE The assignment is needed to force execution
-    ani: ArtistAnimation = ArtistAnimation(figure, frames, blit=True, interval=int(round(scenario.dt * 1000)), repeat=True)
-    ani.save("2018-12-26_BasicUnoptimzedScenario.mp4", writer="ffmpeg")
-
     plt.gca().set_aspect('equal')
+
+    # Predict the states of the ego vehicle
+    predicted_states: List[State] = [planning_problem.initial_state]
+    for _ in range(1, num_time_steps):
+        predicted_states.append(predict_next_state(predicted_states[-1], scenario.dt))
+
+    def draw_frame(time_step: int) -> List[Artist]:
+        return createDynamicObstaclesArtists(scenario.dynamic_obstacles, time_step) \
+               + create_prediction_artists(predicted_states[time_step])
+
+    # Stream the frames of the dynamic obstacles and the predictions of the ego vehicle
+    if output_path is not None:
+        with FrameExporter(figure, output_path, 1 / scenario.dt) as exporter:
+            for time_step in range(0, num_time_steps):
+                frame: List[Artist] = draw_frame(time_step)
+                exporter.write_frame(frame)
+                for artist in frame:
+                    artist.remove()
+
+    # Show the animation of the frames
+    shown_frame: List[Artist] = []
+
+    def update(time_step: int) -> List[Artist]:
+        for artist in shown_frame:
+            artist.remove()
+        shown_frame[:] = draw_frame(time_step)
+        return shown_frame
+
+    # NOTE The assignment is needed to keep the animation alive while it is shown
+    ani: FuncAnimation = FuncAnimation(figure, update, frames=range(0, num_time_steps),
+                                       interval=int(round(scenario.dt * 1000)), repeat=True)
     plt.show()
 
 
@@ -6,8 +6,7 @@ author: Atsushi Sakai (@Atsushi_twi)
 
 """
 
-import random
-import math
+import heapq
 import numpy as np
 import scipy.spatial
 import matplotlib.pyplot as plt
@@ -16,25 +15,11 @@ import matplotlib.pyplot as plt
 N_SAMPLE = 500  # number of sample_points
 N_KNN = 10  # number of edge from one sampled point
 MAX_EDGE_LEN = 30.0  # [m] Maximum edge length
+N_CANDIDATE = 3 * N_KNN  # number of nearest neighbors initially checked for edges of a sampled point
 
 show_animation = True
 
 
-class Node:
-    """
-    Node class for dijkstra search
-    """
-
-    def __init__(self, x, y, cost, pind):
-        self.x = x
-        self.y = y
-        self.cost = cost
-        self.pind = pind
-
-    def __str__(self):
-        return str(self.x) + "," + str(self.y) + "," + str(self.cost) + "," + str(self.pind)
-
-
 class KDTree:
     """
     Nearest neighbor search class with KDTree
@@ -53,14 +38,7 @@ class KDTree:
         """
 
         if len(inp.shape) >= 2:  # multi input
-            index = []
-            dist = []
-
-            for i in inp.T:
-                idist, iindex = self.tree.query(i, k=k)
-                index.append(iindex)
-                dist.append(idist)
-
+            dist, index = self.tree.query(np.asarray(inp).T, k=k)
             return index, dist
         else:
             dist, index = self.tree.query(inp, k=k)
@@ -83,41 +61,50 @@ def PRM_planning(sx, sy, gx, gy, ox, oy, rr):
     if show_animation:
         plt.plot(sample_x, sample_y, ".b")
 
-    road_map = generate_roadmap(sample_x, sample_y, rr, obkdtree)
+    road_map = to_csr(generate_roadmap(sample_x, sample_y, rr, obkdtree), sample_x, sample_y)
 
-    rx, ry = dijkstra_planning(
+    rx, ry = astar_planning(
         sx, sy, gx, gy, ox, oy, rr, road_map, sample_x, sample_y)
 
     return rx, ry
 
 
 def is_collision(sx, sy, gx, gy, rr, okdtree):
-    x = sx
-    y = sy
+    return bool(is_collision_batch(np.array([sx]), np.array([sy]), np.array([gx]), np.array([gy]), rr, okdtree)[0])
+
+
+def is_collision_batch(sx, sy, gx, gy, rr, okdtree):
+    """
+    Collision check of many edges at once
+
+    sx, sy, gx, gy: arrays of start and goal positions of the edges [m]
+    rr: Robot Radius[m]
+    okdtree: KDTree object of obstacles
+    return: boolean array which is True for all edges colliding with an obstacle
+    """
+    sx, sy, gx, gy = (np.asarray(a, dtype=float) for a in (sx, sy, gx, gy))
     dx = gx - sx
     dy = gy - sy
-    yaw = math.atan2(gy - sy, gx - sx)
-    d = math.sqrt(dx**2 + dy**2)
+    yaw = np.arctan2(dy, dx)
+    d = np.hypot(dx, dy)
 
-    if d >= MAX_EDGE_LEN:
-        return True
+    collision = d >= MAX_EDGE_LEN
+    checked = np.flatnonzero(~collision)
+    if len(checked) == 0:
+        return collision
 
+    # interpolate all edges with step size rr and append their goal points
     D = rr
-    nstep = round(d / D)
-
-    for i in range(nstep):
-        idxs, dist = okdtree.search(np.matrix([x, y]).T)
-        if dist[0] <= rr:
-            return True  # collision
-        x += D * math.cos(yaw)
-        y += D * math.sin(yaw)
+    nstep = np.round(d[checked] / D).astype(int) + 1
+    edge = np.repeat(np.arange(len(checked)), nstep)
+    step = np.arange(len(edge)) - np.repeat(np.cumsum(nstep) - nstep, nstep)
+    is_goal = step == np.repeat(nstep - 1, nstep)
+    px = np.where(is_goal, gx[checked][edge], sx[checked][edge] + step * D * np.cos(yaw[checked][edge]))
+    py = np.where(is_goal, gy[checked][edge], sy[checked][edge] + step * D * np.sin(yaw[checked][edge]))
 
-    # goal point check
-    idxs, dist = okdtree.search(np.matrix([gx, gy]).T)
-    if dist[0] <= rr:
-        return True  # collision
-
-    return False  # OK
+    dist, _ = okdtree.tree.query(np.column_stack((px, py)), distance_upper_bound=rr * (1 + 1e-9))
+    collision[checked] = np.bincount(edge, weights=dist <= rr, minlength=len(checked)) > 0
+    return collision
 
 
 def generate_roadmap(sample_x, sample_y, rr, obkdtree):
@@ -130,35 +117,107 @@ def generate_roadmap(sample_x, sample_y, rr, obkdtree):
     obkdtree: KDTree object of obstacles
     """
 
-    road_map = []
     nsample = len(sample_x)
-    skdtree = KDTree(np.vstack((sample_x, sample_y)).T)
+    sample_x = np.asarray(sample_x, dtype=float)
+    sample_y = np.asarray(sample_y, dtype=float)
+    samples = np.column_stack((sample_x, sample_y))
+    skdtree = KDTree(samples)
+
+    road_map = [[] for _ in range(nsample)]
+    # Only samples which do not have N_KNN edges yet and may have further neighbors within MAX_EDGE_LEN are queried
+    # again with twice as many neighbors
+    pending = np.arange(nsample)
+    checked_k = 1  # the nearest neighbor is the sample itself
+    k = min(N_CANDIDATE + 1, nsample)
+    while len(pending) > 0 and checked_k < k:
+        dists, inds = skdtree.tree.query(samples[pending], k=k, distance_upper_bound=MAX_EDGE_LEN)
+        dists, inds = dists[:, checked_k:], inds[:, checked_k:]
+        rows, cols = np.nonzero(np.isfinite(dists))
+        valid = np.zeros(dists.shape, dtype=bool)
+        valid[rows, cols] = ~is_collision_batch(sample_x[pending[rows]], sample_y[pending[rows]],
+                                                sample_x[inds[rows, cols]], sample_y[inds[rows, cols]],
+                                                rr, obkdtree)
+        for row, i in enumerate(pending):
+            missing = N_KNN - len(road_map[i])
+            road_map[i].extend(inds[row][valid[row]][:missing].tolist())
+
+        finished = np.array([len(road_map[i]) >= N_KNN for i in pending], dtype=bool) | ~np.isfinite(dists[:, -1])
+        pending = pending[~finished]
+        checked_k = k
+        k = min(2 * k, nsample)
 
-    for (i, ix, iy) in zip(range(nsample), sample_x, sample_y):
+    #  plot_road_map(road_map, sample_x, sample_y)
 
-        index, dists = skdtree.search(
-            np.matrix([ix, iy]).T, k=nsample)
-        inds = index[0][0]
-        edge_id = []
+    return road_map
 
-        for ii in range(1, len(inds)):
-            nx = sample_x[inds[ii]]
-            ny = sample_y[inds[ii]]
 
-            if not is_collision(ix, iy, nx, ny, rr, obkdtree):
-                edge_id.append(inds[ii])
+def to_csr(road_map, sample_x, sample_y):
+    """
+    Converts a road map to compressed sparse row (CSR) adjacency arrays
 
-            if len(edge_id) >= N_KNN:
-                break
+    road_map: list containing the ids of the neighbors of each sample
+    return: indptr, indices, weights where the neighbors of sample i are indices[indptr[i]:indptr[i + 1]] and the
+    lengths of their edges are weights[indptr[i]:indptr[i + 1]]
+    """
+    indptr = np.zeros(len(road_map) + 1, dtype=int)
+    indptr[1:] = np.cumsum([len(edge_id) for edge_id in road_map])
+    indices = np.fromiter((n_id for edge_id in road_map for n_id in edge_id), dtype=int, count=indptr[-1])
+    sample_x = np.asarray(sample_x, dtype=float)
+    sample_y = np.asarray(sample_y, dtype=float)
+    source = np.repeat(np.arange(len(road_map)), np.diff(indptr))
+    weights = np.hypot(sample_x[indices] - sample_x[source], sample_y[indices] - sample_y[source])
+    return indptr, indices, weights
 
-        road_map.append(edge_id)
 
-    #  plot_road_map(road_map, sample_x, sample_y)
+def shortest_path(csr, sample_x, sample_y, start_id, goal_id, use_heuristic=False):
+    """
+    Dijkstra search (or A* search using the euclidean distance to the goal as heuristic) with a binary heap
 
-    return road_map
+    csr: road map as returned by to_csr(...)
+    start_id, goal_id: ids of the samples to connect
+    return: ids of the samples of the path from the goal to the start (empty if there is no path), boolean array
+    marking all expanded samples
+    """
+    indptr, indices, weights = csr
+    sample_x = np.asarray(sample_x, dtype=float)
+    sample_y = np.asarray(sample_y, dtype=float)
+    nsample = len(indptr) - 1
+    cost = np.full(nsample, np.inf)
+    pind = np.full(nsample, -1, dtype=int)
+    closed = np.zeros(nsample, dtype=bool)
+    if use_heuristic:
+        h = np.hypot(sample_x - sample_x[goal_id], sample_y - sample_y[goal_id])
+    else:
+        h = np.zeros(nsample)
+
+    cost[start_id] = 0.0
+    openset = [(h[start_id], start_id)]
+    while openset:
+        _, c_id = heapq.heappop(openset)
+        if closed[c_id]:
+            continue  # outdated entry of an already expanded sample
+        closed[c_id] = True
+        if c_id == goal_id:
+            break
 
+        # relax all edges of the current sample at once
+        n_ids = indices[indptr[c_id]:indptr[c_id + 1]]
+        n_costs = cost[c_id] + weights[indptr[c_id]:indptr[c_id + 1]]
+        better = (n_costs < cost[n_ids]) & ~closed[n_ids]
+        for n_id, n_cost in zip(n_ids[better], n_costs[better]):
+            cost[n_id] = n_cost
+            pind[n_id] = c_id
+            heapq.heappush(openset, (n_cost + h[n_id], n_id))
 
-def dijkstra_planning(sx, sy, gx, gy, ox, oy, rr, road_map, sample_x, sample_y):
+    if not closed[goal_id]:
+        return [], closed
+    path = [goal_id]
+    while path[-1] != start_id:
+        path.append(pind[path[-1]])
+    return path, closed
+
+
+def dijkstra_planning(sx, sy, gx, gy, ox, oy, rr, road_map, sample_x, sample_y, use_heuristic=False):
     """
     gx: goal x position [m]
     gx: goal x position [m]
@@ -166,69 +225,35 @@ def dijkstra_planning(sx, sy, gx, gy, ox, oy, rr, road_map, sample_x, sample_y):
     oy: y position list of Obstacles [m]
     reso: grid resolution [m]
     rr: robot radius[m]
+    road_map: road map as list of neighbor ids or as returned by to_csr(...). The start and the goal have to be the
+    last two samples.
     """
 
-    nstart = Node(sx, sy, 0.0, -1)
-    ngoal = Node(gx, gy, 0.0, -1)
-
-    openset, closedset = dict(), dict()
-    openset[len(road_map) - 2] = nstart
-
-    while True:
-        if len(openset) == 0:
-            print("Cannot find path")
-            break
+    csr = road_map if isinstance(road_map, tuple) else to_csr(road_map, sample_x, sample_y)
+    path, closed = shortest_path(csr, sample_x, sample_y, len(sample_x) - 2, len(sample_x) - 1, use_heuristic)
 
-        c_id = min(openset, key=lambda o: openset[o].cost)
-        current = openset[c_id]
-
-        # show graph
-        if show_animation and len(closedset.keys()) % 2 == 0:
-            plt.plot(current.x, current.y, "xg")
-            plt.pause(0.001)
-
-        if c_id == (len(road_map) - 1):
-            print("goal is found!")
-            ngoal.pind = current.pind
-            ngoal.cost = current.cost
-            break
+    # show graph
+    if show_animation:
+        plt.plot(np.asarray(sample_x)[closed], np.asarray(sample_y)[closed], "xg")
 
-        # Remove the item from the open set
-        del openset[c_id]
-        # Add it to the closed set
-        closedset[c_id] = current
-
-        # expand search grid based on motion model
-        for i in range(len(road_map[c_id])):
-            n_id = road_map[c_id][i]
-            dx = sample_x[n_id] - current.x
-            dy = sample_y[n_id] - current.y
-            d = math.sqrt(dx**2 + dy**2)
-            node = Node(sample_x[n_id], sample_y[n_id],
-                        current.cost + d, c_id)
-
-            if n_id in closedset:
-                continue
-            # Otherwise if it is already in the open set
-            if n_id in openset:
-                if openset[n_id].cost > node.cost:
-                    openset[n_id].cost = node.cost
-                    openset[n_id].pind = c_id
-            else:
-                openset[n_id] = node
+    if not path:
+        print("Cannot find path")
+        return [], []
+    print("goal is found!")
 
     # generate final course
-    rx, ry = [ngoal.x], [ngoal.y]
-    pind = ngoal.pind
-    while pind != -1:
-        n = closedset[pind]
-        rx.append(n.x)
-        ry.append(n.y)
-        pind = n.pind
-
+    rx = [gx] + [sample_x[i] for i in path[1:]]
+    ry = [gy] + [sample_y[i] for i in path[1:]]
     return rx, ry
 
 
+def astar_planning(sx, sy, gx, gy, ox, oy, rr, road_map, sample_x, sample_y):
+    """
+    Like dijkstra_planning(...) but uses the euclidean distance to the goal as heuristic
+    """
+    return dijkstra_planning(sx, sy, gx, gy, ox, oy, rr, road_map, sample_x, sample_y, use_heuristic=True)
+
+
 def plot_road_map(road_map, sample_x, sample_y):
 
     for i in range(len(road_map)):
@@ -245,18 +270,22 @@ def sample_points(sx, sy, gx, gy, rr, ox, oy, obkdtree):
     minx = min(ox)
     miny = min(oy)
 
-    sample_x, sample_y = [], []
+    sample_x, sample_y = np.empty(0), np.empty(0)
 
     while len(sample_x) <= N_SAMPLE:
-        tx = (random.random() - minx) * (maxx - minx)
-        ty = (random.random() - miny) * (maxy - miny)
+        # rejection sampling of a whole batch of points at once
+        n = N_SAMPLE + 1 - len(sample_x)
+        tx = np.random.random(2 * n) * (maxx - minx) + minx
+        ty = np.random.random(2 * n) * (maxy - miny) + miny
 
-        index, dist = obkdtree.search(np.matrix([tx, ty]).T)
+        dist, _ = obkdtree.tree.query(np.column_stack((tx, ty)))
 
-        if dist[0] >= rr:
-            sample_x.append(tx)
-            sample_y.append(ty)
+        accepted = dist >= rr
+        sample_x = np.concatenate((sample_x, tx[accepted][:n]))
+        sample_y = np.concatenate((sample_y, ty[accepted][:n]))
 
+    sample_x = sample_x.tolist()
+    sample_y = sample_y.tolist()
     sample_x.append(sx)
     sample_y.append(sy)
     sample_x.append(gx)